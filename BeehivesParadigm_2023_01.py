@@ -27,14 +27,35 @@ pilot = False # if True: number of trials each block = number of trials training
 conf_only = False # if True: only do blocks with confidence
 
 
-from psychopy import visual, event, monitors, core, gui, data
+from time import perf_counter
+startup_start = perf_counter() # startup time is measured until the first instruction slide is shown
+
+import sys
+resume = '--resume' in sys.argv # continue an interrupted session (same subject number) from its last checkpoint
+
+from psychopy import visual, event, core # gui and monitors are imported where they are used
 import numpy as np
-import random  
-import statistics
-from win32api import GetSystemMetrics
+from concurrent.futures import ThreadPoolExecutor
 import os 
 import os.path
 from time import sleep
+from display import get_screen_size
+from slides import SlideCache
+from dot_sampler import DotSampler
+from dot_field import DotField
+import task_logic
+from trial_runner import TrialRunner, break_texts
+from scenes import make_scene
+from responses import ResponseCollector
+from trial_writer import TrialWriter
+from profiling import Profiler
+from dot_store import DotStore
+from timeline import compile_timeline, describe, max_flips
+from lab_collector import NetworkSink
+from adaptive import PsychometricGrid
+import design
+from checkpoint import Checkpoint, checkpoint_file, load_checkpoint, session_started, truncate_session
+from frame_timing import FrameTimer, FIXATION, BEEHIVES, BLANK, FEEDBACK, CONFIDENCE, TIMEOUT, ITI
 
 
 # GUI
@@ -43,11 +64,13 @@ if pilot:
     delay_instructions = 0
     
 else:
+    from psychopy import gui # loads the GUI toolkit, only needed for the dialog
     info        = {'sub': 0,'gender':['V','M','X'],'age': 0,'handedness':['R','L']}
+    dialog_start = perf_counter()
     myDlg       = gui.DlgFromDict(dictionary = info, title = "Beehives task",show=True)
+    startup_start += perf_counter() - dialog_start # time spent in the dialog does not count for startup time
     sub = info['sub'];age = info['age'];gender = info['gender'];handedness = info['handedness'];
-    file_name   = "Data\BeehivesTask_sub%d" %(sub) + ".csv" 
-    if os.path.isfile(file_name):
+    if session_started(os.path.join("Data", "DotsTask_sub%d" %(sub))) and not resume: # files of a session that crashed before its first trial do not count
         print('This subject number already exists!')
         core.quit()
     delay_instructions = 1.5 # prevents participant to skip instructions by accident
@@ -55,12 +78,12 @@ else:
 
 
 # Parameters
-# Note: timing duration stimuli depends on refresh rate (should be 60 Hz -> this is checked later in script)
+# Note: durations are in ms and converted to frames for the measured refresh rate (any refresh rate works)
 
 # For prediction confidence:
 #   Three last blocks with confidence: 3 x 64 = 192 trials
 
-shift       = [10,20,30,40,50,60]; np.random.shuffle(shift) # shift in generative mean for post-decisional evidence
+shift       = [10,20,30,40,50,60] # shift in generative mean for post-decisional evidence (order is shuffled for every participant)
 width_add   = 30  # width of generative distribution post-decisional evidence
 add_dots    = 5   # additional dots shown after a response is given ~ post-decisional evidence
 
@@ -76,48 +99,124 @@ nb_total_blocks         = nb_training_blocks + nb_main_blocks
 nb_conf_blocks          = 6                         # last blocks confidence will be asked
 
 max_dots                = 50                        # response deadline is 100ms * max_dots 
+dots_per_frame          = 1                         # number of bees shown at the same time (each dot)
+trail_length            = 0                         # number of previous dots that stay visible with decreasing opacity (0: no trail)
 dif_lvl                 = [1,6,18,80]               # distance mean generative model from center in pixels
+
+adaptive_difficulty     = False                     # replace each difficulty level by the difficulty that targets an accuracy for this participant (adaptive.py)
+target_accuracy         = [0.6,0.7,0.85,0.95]       # targeted accuracy of each level in dif_lvl (only with adaptive_difficulty)
+adaptive_stop_sd        = 0.2                       # the first main block (calibration) ends when the sd of the log threshold is below this value (None: no stopping rule)
+adaptive_min_trials     = 32                        # ... but not before this many answered trials (practice included)
+adaptive_max_trials     = nb_training_trials + nb_main_trials_block # ... and at the latest after this many answered trials, the difficulties are then fixed
 width                   = 70                        # width sampling distribution dots
 
-duration_fixationcross  = 45                        # expressed in number of frames so 750 ms (45*16.67) 
-duration_beehives       = 45                        # 750 ms
-duration_each_dot       = 6                         # 100 ms
+timeline_ms             = {'fixation': 750,         # fixation cross
+                           'beehives': 750,         # beehives before the first dot
+                           'dot':      100,         # each dot, response deadline is dot * max_dots
+                           'blank':    500,         # blank screen after the dots
+                           'feedback': 1000,        # feedback in practice block
+                           'iti':      250}         # inter-trial interval
 
+composite_static        = True                      # draw static parts of the screen (fixation cross, beehives, feedback, confidence scale) as one pre-rendered image
 
-if nb_main_trials_block%16 != 0:
-    print("Number of trials per block is not dividable by 16!")
-    core.quit()
+dot_seed                = None                      # seed for dot sampling (None: new seed each session, saved in data file)
 
-# Definitions
-def divide_chunks(l, n):
-    # looping till length l
-    for i in range(0, len(l), n): 
-        yield l[i:i + n]
+startup_budget_s        = 5.0                       # warn when it takes longer than this until the first instruction slide is shown
 
+collector_address       = None                      # (host, port) of the lab collector (python lab_collector.py), e.g. ('127.0.0.1', 5005); None: local data file only
+
+profile_session         = False                     # record where CPU time goes within the trials (profiling.py), saved as <data file>_trace.json and _folded.txt
+
+max_target_run          = 6                         # at most this many trials in a row with the target on the same side
+design_file             = None                      # json file with the design (see design.py), None: the parameters above
+
+
+# Design: the trial sequence is compiled from these parameters (or from design_file), see design.py
+if design_file is not None:
+    design_config = design.load_config(design_file)
+else:
+    design_config = {'nb_training_blocks': nb_training_blocks, 'nb_training_trials': nb_training_trials, 'nb_main_blocks': nb_main_blocks,
+                     'nb_main_trials_block': nb_main_trials_block, 'nb_conf_blocks': nb_conf_blocks, 'dif_lvl': dif_lvl,
+                     'shift': shift, 'max_target_run': max_target_run, 'pilot': pilot,
+                     'width': width, 'width_add': width_add, 'max_dots': max_dots, 'add_dots': add_dots, 'timeline_ms': timeline_ms}
+try:
+    design_config = design.validate_config(design_config)
+except design.DesignError as error: # e.g. number of trials per block not dividable by 16
+    print(error)
+    core.quit()
+
+break_heights = (30, 25) # text height of the two break screens
+block_worker  = ThreadPoolExecutor(max_workers = 1) # end-of-block summaries are computed while the last trial is still on screen
 
 
 # Create a data folder if it doesn't exist yet 
 my_directory  = os.getcwd()
 if os.path.isdir('Data') == False:
     os.mkdir('Data')
+
+file_name = os.path.join("Data", "DotsTask_sub%d" %(sub))
+
+# Trial sequence: one row per trial (block, trial, difficulty, target, postDecisionEvi, shift, confidence, seed of the dots)
+# 16 trial types (difficulty x target x postDecisionEvi) repeated to the number of trials in a block, every block shuffled on its own
+# A schedule compiled beforehand (python design.py --subjects ...) is used as it is, its design replaces the parameters above
+# The design (with dots and durations) is saved with the schedule, replay and analysis read it from there
+schedule = None
+if os.path.isfile(design.schedule_file(file_name)):
+    schedule, dot_seed, design_config = design.load_schedule(design.schedule_file(file_name))
+    design_config = design.validate_config(design_config)
+nb_training_blocks, nb_training_trials, nb_main_blocks, nb_main_trials_block, nb_conf_blocks, dif_lvl = (design_config[key] for key in 
+    ('nb_training_blocks', 'nb_training_trials', 'nb_main_blocks', 'nb_main_trials_block', 'nb_conf_blocks', 'dif_lvl'))
+width, width_add, max_dots, add_dots, timeline_ms = (design_config[key] for key in ('width', 'width_add', 'max_dots', 'add_dots', 'timeline_ms'))
+nb_total_blocks = nb_training_blocks + nb_main_blocks
+
+# Dot sampling: all dots of a trial are drawn before the trial starts (nothing is sampled in between flips)
+sampler = DotSampler(sub, width, width_add, max_dots, add_dots, seed = dot_seed, dots_per_frame = dots_per_frame)
+if schedule is None:
+    schedule = design.compile_schedule(design_config, sub, sampler.seed)
+    design.save_schedule(design.schedule_file(file_name), schedule, sampler.seed, design_config)
+if adaptive_difficulty and len(target_accuracy) != len(dif_lvl):
+    print('One target accuracy per difficulty level is needed (%d levels)' %(len(dif_lvl)))
+    core.quit()
   
   
   
 # Window     
-screen_width    = GetSystemMetrics(0) 
-screen_height   = GetSystemMetrics(1)
+from psychopy import monitors
+screen_width, screen_height = get_screen_size()
 winSize         = (screen_width,screen_height)
 mon             = monitors.Monitor('testMonitor')
 
 window          = visual.Window(size=winSize, winType='pyglet', fullscr = True, monitor = mon, units="pix", color="black")
+
+
+# Instruction images: decoded when needed (next slide that is shown is prefetched in a background thread), slide 11 ('try to be faster') is kept
+conf_slides = (11,12,14) if sub%2 < 1 else (11,13,14) # different confidence instructions depending on order labels
+slides = SlideCache(window, os.path.join(my_directory, 'Instructions', 'Slide%d.JPG'), order = list(range(7)) + [8,9] + list(conf_slides), keep = [10])
+
+# First slide is shown right away, the refresh rate is measured while it is on screen
+slides[0].autoDraw = True
+window.flip()
+startup_s = perf_counter() - startup_start
+print("Startup time: %.2f s" %(startup_s))
+if startup_s > startup_budget_s:
+    print("Startup took longer than %.1f s!" %(startup_budget_s))
+
 refresh_rate    = visual.getMsPerFrame(myWin=window, nFrames = 60, showVisual=False, msg='', msDelay=0.0)
+slides[0].autoDraw = False
 
 
 
-## Timing stimuli is based on 60 Hz --> 60 frames per second --> 16.67 ms per frame 
-if round(refresh_rate[0],0) != 17: # check refresh rate is ~ 17 Hz
-    print("Refresh rate not okay!")
-    core.quit()
+## Timing stimuli: durations in ms --> number of frames for this display (e.g. 750 ms = 45 frames at 60 Hz, 90 frames at 120 Hz)
+frames                  = compile_timeline(timeline_ms, refresh_rate[0]) # warns when a duration cannot be shown exactly
+duration_fixationcross  = frames['fixation']
+duration_beehives       = frames['beehives']
+duration_each_dot       = frames['dot']
+duration_blank          = frames['blank']
+duration_feedback       = frames['feedback']
+duration_iti            = frames['iti']
+print("Timeline: " + describe(frames, refresh_rate[0]))
+
+timer           = FrameTimer(window, refresh_rate[0], capacity = max_flips(frames, max_dots, add_dots)) # timestamps every flip within a trial (buffers for the longest trial)
 
 
 
@@ -140,69 +239,72 @@ else:
     conf_labels     = visual.TextStim(window,text='Definitely wrong         Probably error      Guess wrong                Guess correct        Probably correct        Definitely correct', height=30, wrapWidth=5000)
 
 
-choice_keys         = ['c','n'] # left, right
-cj_keys             = ['1','2','3','8','9','0']
-
-
-
-# Create trial sequence
-trial_list  = []
-
-target_side = ["left","right"]
-post_evi    = ["stronger","weaker"]
+# Static scenes: each is drawn with one draw call per frame (only the bee is drawn on top)
+scene_fixation      = make_scene(window, [fcross], composite_static)
+scene_beehives      = make_scene(window, [fcross, beehive_left, beehive_right], composite_static)
+scene_good          = make_scene(window, [good], composite_static)
+scene_bad           = make_scene(window, [bad], composite_static)
+scene_confidence    = make_scene(window, [conf_text, conf_labels], composite_static)
 
-for difficulty in dif_lvl: # 16 trial types
-    for target in target_side:
-        for postdecisionevi in post_evi:
-                trial_info = {'difficulty': difficulty,'target': target, 'postDecisionEvi': postdecisionevi} # dictionary is used to read in stimulus information during experiment
-                for rep in range(int(nb_main_trials_block/16)): # repeat some times to obtain number of trials in a block
-                    trial_list.append(trial_info)  
 
-main_trial_list = []
+# Several bees at once and/or trails: all bees are drawn with one ElementArrayStim (dot_field.py) instead of the single circle
+multi_dots = dots_per_frame > 1 or trail_length > 0
+if multi_dots:
+    bee = DotField(window, dots_per_frame, trail_length, size = 10)
 
-for block in range(nb_main_blocks): # shuffle order and add to list to obtain sequence over all blocks
-    random.shuffle(trial_list)
-    main_trial_list.append(trial_list)
 
-
-
-# create list with trials for practice blocks
-practice_trial_list = []
-
-for i in range(nb_training_trials):
-    practice_trial = {'difficulty': random.choice(dif_lvl[1:4]),'target': random.choice(['left','right']), 'postDecisionEvi' : random.choice(["stronger","weaker"])} # only the three easiest conditions
-    practice_trial_list.append(practice_trial)
+choice_keys         = ['c','n'] # left, right
+cj_keys             = ['1','2','3','8','9','0']
 
 
 
-# create list for easier testing (with less trials in block)
-testing_trials = [] 
-for i in range(nb_training_trials*nb_main_blocks):
-    testing_trials.append(random.choice(trial_list))
+# Adaptive difficulty: posterior over the psychometric function of this participant (likelihood tables are computed here, once)
+if adaptive_difficulty:
+    psychometric = PsychometricGrid(difficulties = np.arange(1, max(dif_lvl)+1)) # difficulty never beyond the beehives
 
-testing_trial_list = list(divide_chunks(testing_trials, nb_training_trials)) 
 
+# Initialization variables for feedback on performance in between blocks
+prev_feedback_acc = []
+prev_feedback_rt = []
 
 
+# Resume an interrupted session: restore the state of the last checkpoint and cut the data files back to it
+resume_state = None
+if resume:
+    if not session_started(file_name): # stopped before the first trial was written: start again
+        print('No trials for this subject number yet, starting a new session')
+        resume = False
+    elif not os.path.isfile(checkpoint_file(file_name)):
+        print('No checkpoint for this subject number!')
+        core.quit()
+if resume:
+    resume_state        = load_checkpoint(checkpoint_file(file_name))
+    try:
+        truncate_session(file_name, resume_state)
+    except ValueError as error: # e.g. power cut: checkpoint saved, data not on disk
+        print(error)
+        core.quit()
+    # the schedule (and with it the seeds of the dots) was loaded from the schedule file above
+    prev_feedback_acc   = resume_state['prev_feedback_acc']
+    prev_feedback_rt    = resume_state['prev_feedback_rt']
+    if adaptive_difficulty and resume_state.get('psychometric') is not None:
+        psychometric.set_state(*resume_state['psychometric'])
+    print("Resuming block %d after trial %d" %(resume_state['block'], resume_state['trial']))
 
         
-# TrialHandler: make a data file
-file_name = "Data\DotsTask_sub%d" %(sub)
-info           = {"sub": sub,"age": age, "gender": gender, "handedness": handedness}
-thisExp = data.ExperimentHandler(dataFileName = file_name,extraInfo=info)
-
-
-# Instruction images
-imagepath = my_directory + '\Instructions\Slide'
-image = []
-for number_image in range(15):
-    image_id = imagepath + str(number_image+1) + '.JPG' #import image 
-    image.append(visual.ImageStim(window, image_id)) #convert as 'Image Stimulus'
-
+# TrialWriter: make a data file (each trial is written to disk as soon as it is finished)
+info           = {"sub": sub,"age": age, "gender": gender, "handedness": handedness, "dot_seed": sampler.seed, "frame_ms": refresh_rate[0], "startup_s": round(startup_s, 3),
+                  "dots_per_frame": dots_per_frame, "trail_length": trail_length} # bees of one dot are consecutive dots in the dot store
+profiler = Profiler(enabled = profile_session) # disabled: the hooks in the trial loop cost well below 1 us each
+dot_store = DotStore(file_name, append = resume) # dot coordinates are stored in a binary file, the csv file only has the trial index (dots_index)
+checkpoint = Checkpoint(file_name) # saved after every trial by the writer thread, fsync'ed with the data
+thisExp = TrialWriter(dataFileName = file_name,extraInfo=info,sync_also=[dot_store, checkpoint],append = resume)
 
-# Initialization variables for feedback on performance in between blocks
-prev_feedback_acc = []
-prev_feedback_rt = []
+# Lab collector: completed trials are also sent over the network by a background thread (spooled to a local file when the collector is down)
+network_sink = None
+if collector_address is not None:
+    import socket
+    network_sink = NetworkSink(collector_address, station = socket.gethostname(), spool_file = os.path.join('Data', 'collector_spool.jsonl'), extra_info = info)
 
 
 ##############
@@ -210,190 +312,110 @@ prev_feedback_rt = []
 ##############
 
 mouse = event.Mouse(visible = False) 
-clock = core.Clock()
+responses = ResponseCollector(window) # choice and confidence keys
+
+# Work in between flips (dots, keyboard checks, data of the trial), same code as in the benchmarks (benchmarks.py)
+runner = TrialRunner(scene_beehives, bee, timer, responses, sampler, profiler, frames, choice_keys, width, multi_dots)
+
+# Break screens: made once, only their text is set during the ITI of the last trial of a block
+break_stims = [visual.TextStim(window, text=' ', pos=(0,0), height=height, wrapWidth=5000) for height in break_heights]
+
+if resume_state is None: # no instructions again when resuming
+    for image_number in range(7): # present instructions
+        slides[image_number].draw()
+        window.flip()
+        event.clearEvents('keyboard')
+        sleep(delay_instructions) 
+        event.waitKeys(keyList = ['space'])
+        slides.release(image_number) # instruction slides are shown once
+slides.prefetch(10) # 'try to be faster' slide is ready before the first trial
 
-for image_number in range(7): # present instructions
-    image[image_number].draw()
-    window.flip()
-    event.clearEvents('keyboard')
-    sleep(delay_instructions) 
-    event.waitKeys(keyList = ['space'])
+first_block = resume_state['block'] if resume_state else 0
 
-for block in range(nb_total_blocks):
+for block in range(first_block, nb_total_blocks):
+    resumed_block = resume_state is not None and block == resume_state['block'] # instructions of this block were already shown
+    which_trial_list = schedule[schedule['block'] == block] # trials of this block (pilot: shorter blocks, already in the schedule)
+    
     if block == 0:
         running = "practice"
-        which_trial_list = practice_trial_list
         
         
-    if block == 1: # indicates end of practice trials and start of main experiment (see if statement below)
+    if block == 1 and not resumed_block: # indicates end of practice trials and start of main experiment (see if statement below)
         for image_number in range(8,10): # present instructions
-            image[image_number].draw()
+            slides[image_number].draw()
             window.flip()
             event.clearEvents('keyboard')
             sleep(delay_instructions)
             event.waitKeys(keyList = ['space'])
+            slides.release(image_number)
         
     if block >= nb_training_blocks:
-        if block == nb_total_blocks - nb_conf_blocks: # give confidence instructions
-            if sub%2 < 1: # show different confidence instructions depending on order labels
-                which_image = (11,12,14)
-            else:
-                which_image = (11,13,14)
-
-
+        if block == nb_total_blocks - nb_conf_blocks and not resumed_block: # give confidence instructions
             print("confidence blocks start")
-            for image_number in which_image: # present instructions
-                image[image_number].draw()
+            for image_number in conf_slides: # present instructions (depend on order labels)
+                slides[image_number].draw()
                 window.flip()
                 event.clearEvents('keyboard')
                 sleep(delay_instructions)
                 event.waitKeys(keyList = ['space'])
+                slides.release(image_number)
             
         running = "main"
-        if pilot: # trials come from a shorter list (so experiment is over more quickly)
-            which_trial_list = testing_trial_list[block-1]
-        else:
-            which_trial_list = main_trial_list[block-1] # already 1 practice block so block = 1 and argument [] has to start with 0
     
     ##################
     # Within a block #
     ##################
     
-    feedback_acc    = []
-    feedback_rt     = []
+    feedback_acc    = list(resume_state['feedback_acc']) if resumed_block else []
+    feedback_rt     = list(resume_state['feedback_rt']) if resumed_block else []
+    break_block     = running == "main" and block < (nb_total_blocks-1) # pause after this block (not after the last block)
+    break_job       = None # block summary + break texts (block_worker)
+    break_set       = 0    # break screens with the texts of this block
+    calibration     = adaptive_difficulty and adaptive_stop_sd is not None and block == nb_training_blocks # block ends when the threshold is known (stopping rule)
 
     
-    trial_number = 0 
+    trial_number = resume_state['trial'] if resumed_block else 0 
     
-    for trial in which_trial_list: 
+    for trial in which_trial_list[trial_number:]: 
         
         ##################
         # Within a trial #
         ##################
         
         trial_number += 1
-        
-        for frameN in range(duration_fixationcross): # 750 ms (fixation cross)
-            fcross.draw()
-            window.flip()
-        
-        for frameN in range(duration_beehives): # 750 ms (beehives)
-            fcross.draw()
-            beehive_left.draw()
-            beehive_right.draw()
-            window.flip()
-        
-        
-        location_dots = [] # to save coordinates of dots
-        location_add_dots = [] # to save coordinates of post-decisional dots
-
+        profiler.set_trial(thisExp.n_entries) # row of this trial in the data file
+        profiler.begin('trial')
         
         # Configuration generative distribution for bee positions
         # Dot locations are sampled from a bivariate normal distribution with a generative mean (which is varied to determine trial difficulty), a fixed variance and 0 covariance
-        if trial['target'] == 'left':
-            mean = [-trial['difficulty'],0]
-            
-        else:
-            mean = [trial['difficulty'],0]
+        # With adaptive difficulty the level of the trial list is replaced by the difficulty that targets the accuracy of this level
+        profiler.begin('sampling')
+        difficulty = int(trial['difficulty'])
+        if adaptive_difficulty:
+            difficulty = int(psychometric.next_difficulty(target_accuracy[dif_lvl.index(trial['difficulty'])]))
+        mean = [int(task_logic.generative_mean(difficulty, trial['target_right'])),0]
             
-        cov = [[width**2, 0],[0, width**2]] # see Park (2016)
+        runner.start_trial(mean, difficulty, block, trial_number, trial['seed']) # sample all dots of this trial at once, before the first flip of the trial
+        profiler.end()
         
+        runner.show_scene(scene_fixation, FIXATION, duration_fixationcross) # fixation cross
+        runner.show_scene(scene_beehives, BEEHIVES, duration_beehives) # fixation cross + beehives
         
-        resp = []
-        event.clearEvents('keyboard') 
-        clock.reset() 
+        # Present dots until response is given (keyboard is checked after every frame)
+        key = runner.pre_decision()
+        response_given = int(key is not None) # we need this variable to present an additional instruction ("be faster") after a timed-out trial
         
+        # in training blocks post-decisional evidence is drawn from distribution with mean the average x coordinates of previous dots
+        # in the main experiment, we'll manipulate this mean by adding or substracting a constant
+        # to increase the evidence strength (leading to higher confidence), or decrease (leading to lower confidence)
+        if response_given == 1: # if response is given show post-decisional evidence 
+            runner.post_decision(trial['stronger'], int(trial['shift'])) # shift is 0 in training block and first experiment block (without confidence)
         
-        # Present dots until response is given
-        for number in range(max_dots):
-            
-            # Sample bee location from bivariate normal distribution
-            x,y     = np.random.multivariate_normal(mean,cov) 
-            bee.pos = (x,y)
-            location_dots.append((x,y)) # save dot location
-                    
-            # timing response relative last clock.reset()
-            resp = event.getKeys(keyList = choice_keys, timeStamped = clock) #output eg: [['n', 2.22]] 
-            
-
-            # stop stimulus presentation when response is given (does not work if placed in for-loop below)
-            # if checked after for-loop below then 1 additional dot is presented
-            
-            if len(resp) > 0:  # if response is given show post-decisional evidence 
-            
-                response_given = 1
-                
-                mean_dots = np.mean([x_dot[0] for x_dot in location_dots]) # extract x coordinate each dot and take mean
-                mean_add_dots = mean_dots
-                
-                # in training blocks post-decisional evidence is drawn from distribution with mean the average x coordinates of previous dots
-                # in the main experiment, we'll manipulate this mean by adding or substracting a constant
-                # to increase the evidence strength (leading to higher confidence), or decrease (leading to lower confidence)
-                
-                if block <= 1: # training block and first experiment block (without confidence)
-                    shft = 0
-                else:
-                    shft = shift[block - 2]
-
-                
-                if block >= nb_training_blocks:
-                    if ((mean_add_dots > 0 and trial['postDecisionEvi'] == 'stronger') or (mean_add_dots <= 0 and trial['postDecisionEvi'] == 'weaker')):
-                        mean_add_dots += shft 
-                    else:
-                        mean_add_dots -= shft
-
-                for number in range(add_dots):
-                    x,y     = np.random.multivariate_normal([mean_add_dots,0],[[width_add**2, 0],[0, width**2]])
-                    bee.pos = (x,y)
-                    location_add_dots.append((x,y))
-                    
-                    for frameN in range(duration_each_dot): # each dot 100 ms 
-                        fcross.draw()
-                        beehive_left.draw()
-                        beehive_right.draw()
-                        bee.draw()
-                        window.flip()
-                        
-                mean_add_dots = np.mean([x_dot_add[0] for x_dot_add in location_add_dots]) # extract x coordinate each dot and take mean
-
-                
-                break # here we break out of the dot presentation loop
-            
-            else: # we need this variable to present an additional instruction ("be faster") after a timed-out trial
-                response_given = 0
-            
-
-            # Present one dot
-            for frameN in range(duration_each_dot): # each dot 100 ms 
-                fcross.draw()
-                beehive_left.draw()
-                beehive_right.draw()
-                bee.draw()
-                window.flip()
-                
-                
-        
-        # Save some data and 
-        distance           = mean[0]
-        diff               = trial['difficulty']
-        targ               = trial['target'] 
-        shift_post_dots    = trial['postDecisionEvi']
-        shift_value        = shft
-
+        response, rt, key_time, ACC = runner.outcome() # accuracy relative to the average evidence that was shown
         
-                
-
         if response_given == 1:
-
-            response    = resp[0][0]
-            rt          = resp[0][1]
-            
-            #accuracy
-            if ((mean_dots < 0 and resp[0][0] == choice_keys[0]) or (mean_dots >= 0 and resp[0][0] == choice_keys[1])):
-                ACC = 1
-            elif ((mean_dots < 0 and resp[0][0] == choice_keys[1]) or (mean_dots >= 0 and resp[0][0] == choice_keys[0])):
-                ACC = 0
-  
+            if adaptive_difficulty and not (adaptive_stop_sd is not None and psychometric.converged(adaptive_stop_sd, adaptive_min_trials, adaptive_max_trials)):
+                psychometric.update(difficulty, ACC) # posterior update (< 1 ms), timed-out trials are not used, none after the stopping rule was met
 
             # add to list to calculate average over block for performance feedback
             feedback_acc.append(ACC)
@@ -401,55 +423,32 @@ for block in range(nb_total_blocks):
             
         # Show instruction 'try to be faster' if timed-out
         if response_given == 0:
-                        
-            response = 'timed-out'
-            rt = -99
-            ACC = -99
-            RTconf = -99
-            cj = -99
-            image[10].draw()
-            window.flip()
+            slides[10].draw()
+            timer.flip(TIMEOUT)
             event.clearEvents('keyboard')
             event.waitKeys(keyList = ['space'])
+            timer.gap()
                       
               
-        for frameN in range(30): # 500ms 
-            window.flip()
+        runner.show_scene(None, BLANK, duration_blank) # blank screen
              
         # Feedback is given in first practice block  
         if block == 0 and response_given == 1: 
-            for frameN in range(60):
-                if ACC == 1:
-                    good.draw()
-                    window.flip()
-                else:
-                    bad.draw()
-                    window.flip()
-            
-            # no confidence is asked yet but otherwise problem with data saving
-            RTconf      = -99
-            cj          = -99
-                            
-
+            runner.show_scene(scene_good if ACC == 1 else scene_bad, FEEDBACK, duration_feedback)
             
         # Ask for CONFIDENCE about the choice the last X blocks
-        if block >= nb_total_blocks - nb_conf_blocks and response_given == 1:
-            conf_text.draw()
-            conf_labels.draw()
-            window.flip()
-            clock.reset()
-            event.clearEvents()
-            conf_press = event.waitKeys(keyList = cj_keys)
-            RTconf = clock.getTime()
-
-            #Convert conf_press into numeric value from 1 (sure error) to 6
-            for temp in range(0,6):
-                if conf_press[0] == cj_keys[temp]:
-                    cj = temp+1
-                    
-            #reverse order for half
-            if sub%2 < 1:
-                cj = 7-cj
+        if trial['confidence'] and response_given == 1:
+            scene_confidence.draw()
+            responses.clear()
+            responses.reset_clock_on_flip()
+            timer.flip(CONFIDENCE)
+            with profiler.phase('confidence_wait'):
+                conf_press = responses.wait(cj_keys).name
+            RTconf = responses.key.rt
+            timer.gap()
+
+            #Convert conf_press into numeric value from 1 (sure error) to 6 (order reversed for half)
+            cj = int(task_logic.confidence_rating(cj_keys.index(conf_press), sub))
                         
         else:
             conf_press = 'none'
@@ -457,62 +456,70 @@ for block in range(nb_total_blocks):
             RTconf = -99
         
         
-        for frameN in range(15): # 250ms ITI
-            window.flip()
+        # Last trial of the block: summary and break texts are computed in the background,
+        # the texts of the break screens are set in between the (blank) ITI frames, so the break appears instantly
+        last_trial = trial_number == len(which_trial_list) or (calibration and psychometric.converged(adaptive_stop_sd, adaptive_min_trials, adaptive_max_trials))
+        if break_block and last_trial and feedback_rt:
+            break_job = block_worker.submit(break_texts, list(feedback_acc), list(feedback_rt), nb_total_blocks - (block+1), prev_feedback_acc, prev_feedback_rt, block == 1)
+        
+        for frameN in range(duration_iti): # ITI
+            if break_job is not None and break_job.done() and break_set < len(break_stims): # one text per frame
+                break_stims[break_set].setText(break_job.result()[2][break_set])
+                break_set += 1
+            timer.flip(ITI)
             
             
         # Save data of current trial        
-        thisExp.addData("block", block)
-        thisExp.addData("trial", trial_number)
-        thisExp.addData("running", running) #practice or main
-        thisExp.addData("difficulty", diff) #absolute distance from the center
-        thisExp.addData("distance", distance) #signed distance from the center
-        thisExp.addData("target", targ)
-        thisExp.addData("response", response)
-        thisExp.addData("accuracy", ACC)
-        thisExp.addData("rt", rt)
-        thisExp.addData("cj", cj)
-        thisExp.addData("RTconf", RTconf)
-        thisExp.addData("pre_dots_location", location_dots) # coordinates each dots
-        thisExp.addData("pre_dots_location_mean", mean_dots) # mean x coordinates all dots
-        thisExp.addData("post_dots_location", location_add_dots)
-        thisExp.addData("post_dots_location_mean", mean_add_dots)
-        thisExp.addData("shift_post_dots", shift_post_dots)
-        thisExp.addData("shift", shift_value)
-
-        
-
-        # Proceed to next trial
-        thisExp.nextEntry()
-        
-        window.flip()
+        profiler.begin('record')
+        runner.record(thisExp, dot_store, trial, running, dif_lvl.index(trial['difficulty']), # level in dif_lvl (with adaptive difficulty: index in target_accuracy)
+                      round(psychometric.threshold()[0], 2) if adaptive_difficulty else -99, cj, RTconf)
+        profiler.end()
+
+        # Proceed to next trial (trial is written to disk by the writer thread)
+        profiler.begin('next_entry')
+        entry = thisExp.nextEntry()
+        if network_sink is not None:
+            network_sink.put(entry)
+        
+        # Checkpoint to resume from the next trial (saved by the writer thread once this trial is on disk), after the last trial of a block from the next block
+        thisExp.call(checkpoint.save, {
+            'block': block, 'trial': len(which_trial_list) if last_trial else trial_number, 'rows': thisExp.n_entries, 'dots': dot_store.n_dots, 'durations': dot_store.n_durations,
+            'dot_seed': sampler.seed,
+            'prev_feedback_acc': prev_feedback_acc, 'prev_feedback_rt': prev_feedback_rt,
+            'feedback_acc': list(feedback_acc), 'feedback_rt': list(feedback_rt),
+            'psychometric': (psychometric.log_posterior.copy(), psychometric.n_trials) if adaptive_difficulty else None})
+        profiler.end()
+        
+        timer.flip(ITI)
+        profiler.end() # trial
         if event.getKeys(keyList = ['escape']):
+            profiler.export(file_name)
             window.close()
             core.quit()
+        if last_trial: # end of the block (earlier for the calibration block)
+            if trial_number < len(which_trial_list):
+                print("Calibration ended after %d trials, threshold %.1f px" %(psychometric.n_trials, psychometric.threshold()[0]))
+            break
 
 
     # End of block: pause and performance feedback
-    if running == "main" and block < (nb_total_blocks-1): # pause should not be presented after last block
-        
-        # Calculate some performance stats
-        mean_rt = round(statistics.mean(feedback_rt)*1000,0) # in ms
+    if break_block: # pause should not be presented after last block
         
-        percentage_acc = round(statistics.mean(feedback_acc) * 100,0)
+        # Performance stats (normally ready since the last trial, e.g. not when resuming at the end of a block)
+        if break_job is None:
+            break_job = block_worker.submit(break_texts, list(feedback_acc), list(feedback_rt), nb_total_blocks - (block+1), prev_feedback_acc, prev_feedback_rt, block == 1)
+        mean_rt, percentage_acc, texts = break_job.result()
+        while break_set < len(break_stims): # ITI was too short to set both break screens
+            break_stims[break_set].setText(texts[break_set])
+            break_set += 1
         
-
         # Present break + performance stats
-        break1 = visual.TextStim(window,text='Break :)  \n\n Blocks remaining: ' + str(nb_total_blocks - (block+1)) + '\n\n\n\n Press SPACE to see performance summary', pos=(0,0),height=30, wrapWidth=5000)
-
-        if block == 1: # in first block after practice no prev performance stats available 
-            break2 = visual.TextStim(window,text='Average response time: ' + str(mean_rt) + ' ms \n\n Average accuracy: ' + str(percentage_acc) + '% \n\n\n\n\n Try to improve these scores by responding faster and more accurately! \n\n\n\n\n\n\n Press SPACE to continue the experiment.', pos=(0,0),height=25, wrapWidth=5000)
-        else: # first performance stats and those of previous round
-            break2 = visual.TextStim(window,text='Average response time: ' + str(mean_rt) + ' ms   (previous block: ' + str(prev_feedback_rt) + ' ms)\n\n Average accuracy: ' + str(percentage_acc) + '%   (previous block: ' + str(prev_feedback_acc) + '%) \n\n\n\n\n Try to improve these scores by responding faster and more accurately! \n\n\n\n\n\n\n Press SPACE to continue the experiment.', pos=(0,0),height=25, wrapWidth=5000)
-        
-        break1.draw()
+        break_stims[0].draw()
         window.flip()
+        thisExp.flush() # all trials of this block on disk while the break is on screen (not in between stimulus frames)
         event.waitKeys(keyList = 'space')
         
-        break2.draw()
+        break_stims[1].draw()
         window.flip()
         event.waitKeys(keyList = 'space')
         
@@ -524,7 +531,14 @@ for block in range(nb_total_blocks):
 end.draw()
 window.flip()
 
-# Data will be written when Python is closed
+# All trials are already on disk, close() only waits for the last ones to be written
+thisExp.close()
+dot_store.close()
+profiler.export(file_name) # Chrome trace + folded stacks (only when profile_session)
+if network_sink is not None:
+    network_sink.close() # trials that could not be sent stay in the spool file and are sent by the next session on this PC
+block_worker.shutdown()
+os.remove(checkpoint_file(file_name)) # session is complete, nothing to resume
 event.waitKeys(keyList = 'space')
 window.close()
                 
@@ -0,0 +1,127 @@
+"""
+Adaptive difficulty for the Beehives Paradigm (Bayesian estimate of the psychometric function on a grid)
+
+- Psychometric function of the generative mean d (distance from the center in pixels):
+  P(correct) = 0.5 + (0.5 - lapse) * (1 - exp(-(d/threshold)**slope))   (Weibull, 2 alternatives)
+  at d = threshold the accuracy is about 81%.
+- The posterior over (threshold, slope) lives on a fixed grid. P(correct) for every candidate difficulty and every grid
+  point is computed once (likelihood tables), so after a trial the update is one addition of a table row
+  and choosing the next difficulty is one matrix-vector product (well below 1 ms).
+- The next difficulty is the candidate whose expected accuracy (over the posterior) is closest to the target accuracy.
+  The experiment keeps its trial list (target x postDecisionEvi balance) and only replaces
+  each difficulty level by the difficulty that targets the accuracy of that level.
+- Stopping rule (converged): the posterior sd of the log threshold is below a tolerance after a minimum number of
+  trials, or a maximum number of trials was reached. The experiment then ends the calibration block.
+
+Usage: python adaptive.py  (times the update and the choice of the next difficulty and runs a simulated observer)
+"""
+
+import argparse
+from time import perf_counter
+
+import numpy as np
+
+
+def weibull(difficulty, threshold, slope, lapse):
+    return 0.5 + (0.5 - lapse) * (1 - np.exp(-(difficulty / threshold) ** slope))
+
+
+class PsychometricGrid:
+
+    def __init__(self, difficulties=np.arange(1, 81), thresholds=np.geomspace(1, 160, 80),
+                 slopes=np.geomspace(0.5, 6, 20), lapse=0.02):
+        self.difficulties   = np.asarray(difficulties, dtype=float)
+        self.thresholds     = np.asarray(thresholds, dtype=float)
+        self.slopes         = np.asarray(slopes, dtype=float)
+
+        # likelihood tables: (n_difficulties, n_thresholds * n_slopes)
+        p                   = weibull(self.difficulties[:,None,None], self.thresholds[None,:,None], self.slopes[None,None,:], lapse)
+        self.p_correct      = p.reshape(len(self.difficulties), -1)
+        self.log_correct    = np.log(self.p_correct)
+        self.log_error      = np.log1p(-self.p_correct)
+
+        self.log_threshold  = np.repeat(np.log(self.thresholds), len(self.slopes)) # grid point -> log threshold
+        self.reset()
+
+
+    def reset(self):
+        self.log_posterior  = np.zeros(self.p_correct.shape[1]) # flat prior over log threshold and log slope
+        self.posterior      = np.full(self.p_correct.shape[1], 1 / self.p_correct.shape[1])
+        self.n_trials       = 0
+
+
+    def update(self, difficulty, correct):
+        i                   = self._index(difficulty)
+        self.log_posterior += self.log_correct[i] if correct else self.log_error[i]
+        self.log_posterior -= self.log_posterior.max()
+        self.posterior      = np.exp(self.log_posterior)
+        self.posterior     /= self.posterior.sum()
+        self.n_trials      += 1
+
+
+    def set_state(self, log_posterior, n_trials):
+        # restore the posterior (e.g. from a checkpoint)
+        self.log_posterior  = np.array(log_posterior, dtype=float)
+        self.posterior      = np.exp(self.log_posterior - self.log_posterior.max())
+        self.posterior     /= self.posterior.sum()
+        self.n_trials       = n_trials
+
+
+    def expected_accuracy(self):
+        # expected P(correct) of every candidate difficulty under the current posterior
+        return self.p_correct @ self.posterior
+
+
+    def next_difficulty(self, target_accuracy):
+        return self.difficulties[np.argmin(np.abs(self.expected_accuracy() - target_accuracy))]
+
+
+    def threshold(self):
+        # posterior mean and standard deviation of the threshold (on log scale, returned in pixels)
+        mean    = self.posterior @ self.log_threshold
+        sd      = np.sqrt(self.posterior @ (self.log_threshold - mean)**2)
+        return np.exp(mean), sd
+
+
+    def converged(self, sd_tolerance, min_trials=0, max_trials=None):
+        # stopping rule: threshold known well enough (sd of the log threshold) after min_trials, or max_trials reached
+        if max_trials is not None and self.n_trials >= max_trials:
+            return True
+        return self.n_trials >= min_trials and self.threshold()[1] <= sd_tolerance
+
+
+    def _index(self, difficulty):
+        return np.argmin(np.abs(self.difficulties - difficulty))
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time the adaptive difficulty engine and run it on a simulated observer')
+    parser.add_argument('--trials', type=int, default=128)
+    parser.add_argument('--threshold', type=float, default=12.0, help='threshold of the simulated observer (pixels)')
+    parser.add_argument('--slope', type=float, default=1.5)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--stop-sd', type=float, default=None, help='stop when the sd of the log threshold is below this value')
+    parser.add_argument('--min-trials', type=int, default=20, help='minimum number of trials before stopping (with --stop-sd)')
+    args = parser.parse_args()
+
+    rng             = np.random.default_rng(args.seed)
+    target_accuracy = [0.6, 0.7, 0.85, 0.95]
+
+    start           = perf_counter()
+    grid            = PsychometricGrid()
+    print('Likelihood tables: %.1f ms' % ((perf_counter() - start) * 1000))
+
+    times = []
+    for trial in range(args.trials):
+        start       = perf_counter()
+        difficulty  = grid.next_difficulty(target_accuracy[trial % len(target_accuracy)])
+        correct     = rng.random() < weibull(difficulty, args.threshold, args.slope, 0.02)
+        grid.update(difficulty, correct)
+        times.append(perf_counter() - start)
+        if args.stop_sd is not None and grid.converged(args.stop_sd, args.min_trials):
+            break
+
+    threshold, sd = grid.threshold()
+    print('Update + next difficulty: median %.3f ms, max %.3f ms' % (np.median(times) * 1000, np.max(times) * 1000))
+    print('Threshold after %d trials: %.1f px (true %.1f), sd of log threshold %.3f' % (grid.n_trials, threshold, args.threshold, sd))
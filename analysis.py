@@ -0,0 +1,225 @@
+"""
+Multi-subject analysis of the Beehives Paradigm data
+
+- Every Data/DotsTask_subN.csv is read once and converted into a numpy structured array (one row per trial),
+  saved as Data/store/DotsTask_subN.npy. A manifest remembers which files (and versions) were converted,
+  so updating the store only reads new or changed subject files (and files converted with an older trial_dtype).
+- Subjects are converted in a process pool.
+- Evidence means and number of dots come from the binary dot store (dot_store.py) if it exists,
+  or from the string-encoded dot lists of older data files. With several bees per dot (dots_per_frame)
+  n_pre_dots/n_post_dots count dots, not bees.
+- Per-trial features are computed vectorized over all trials: previous choice/confidence/accuracy,
+  repetition of the previous choice, shift condition, ...
+- load_store() memory-maps all subject arrays and concatenates them.
+
+Usage: python analysis.py [--data Data] [--workers 4]
+"""
+
+import argparse
+import csv
+import glob
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from dot_store import DotStoreReader, store_files
+
+
+choice_keys = ['c','n'] # left, right (same as in the experiment script)
+
+store_format = 2        # version of trial_dtype: subject files converted with another version are converted again
+
+trial_dtype = np.dtype([
+    ('sub',             np.int32),
+    ('block',           np.int16),
+    ('trial',           np.int16),
+    ('main',            np.bool_),   # False: practice
+    ('difficulty',      np.float32),
+    ('distance',        np.float32), # signed generative mean
+    ('target_right',    np.int8),
+    ('response_right',  np.int8),    # -99: timed-out
+    ('accuracy',        np.int8),
+    ('rt',              np.float32),
+    ('cj',              np.int8),
+    ('RTconf',          np.float32),
+    ('stronger',        np.int8),    # post-decisional evidence 'stronger' (1) or 'weaker' (0)
+    ('shift',           np.float32),
+    ('pre_mean',        np.float32), # mean x coordinate of the dots before the response
+    ('post_mean',       np.float32),
+    ('n_pre_dots',      np.int16),
+    ('n_post_dots',     np.int16),
+    ('dots_index',      np.int32),   # trial in the dot store (-99: no dot store)
+    ('dots_per_frame',  np.int16),   # bees per dot (dot_field.py)
+    # features (computed from the trials above)
+    ('prev_valid',      np.bool_),   # previous trial in the same block with a response
+    ('prev_response_right', np.int8),
+    ('prev_accuracy',   np.int8),
+    ('prev_cj',         np.int8),
+    ('prev_stronger',   np.int8),
+    ('prev_shift',      np.float32),
+    ('repeat',          np.int8),    # same choice as on the previous trial (-99: not defined)
+])
+
+number = re.compile(r'-?\d+\.?\d*(?:[eE][-+]?\d+)?')
+
+
+def to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return -99.0
+
+
+def legacy_dots(text):
+    # '[(np.float64(1.5), np.float64(-3.2)), ...]' or '[(1.5, -3.2), ...]' -> x coordinates
+    values = [float(v) for v in number.findall(text.replace('np.float64', ''))]
+    return np.array(values[0::2])
+
+
+def ingest_subject(csv_file):
+    with open(csv_file, newline='') as f:
+        rows = list(csv.DictReader(f))
+
+    arr = np.zeros(len(rows), dtype=trial_dtype)
+    if len(rows) == 0:
+        return arr
+
+    def column(name, convert=to_float, default=-99.0):
+        return np.array([convert(row[name]) if name in row else default for row in rows])
+
+    arr['sub']              = column('sub')
+    arr['block']            = column('block')
+    arr['trial']            = column('trial')
+    arr['main']             = column('running', str, '') == 'main'
+    arr['difficulty']       = column('difficulty')
+    arr['distance']         = column('distance')
+    arr['target_right']     = column('target', str, '') == 'right'
+    response                = column('response', str, '')
+    arr['response_right']   = np.where(response == choice_keys[1], 1, np.where(response == choice_keys[0], 0, -99))
+    arr['accuracy']         = column('accuracy')
+    arr['rt']               = column('rt')
+    arr['cj']               = column('cj')
+    arr['RTconf']           = column('RTconf')
+    arr['stronger']         = column('shift_post_dots', str, '') == 'stronger'
+    arr['shift']            = column('shift')
+    arr['pre_mean']         = column('pre_dots_location_mean')
+    arr['post_mean']        = column('post_dots_location_mean')
+    arr['dots_index']       = -99
+    arr['dots_per_frame']   = np.maximum(column('dots_per_frame', default=1), 1)
+
+    base = os.path.splitext(csv_file)[0]
+    if 'dots_index' in rows[0] and os.path.isfile(store_files(base)[1]):
+        # binary dot store: means and number of dots without parsing text
+        dots                = DotStoreReader(base)
+        index               = column('dots_index').astype(np.int64)
+        pre_mean, post_mean = dots.means()
+        arr['dots_index']   = index
+        arr['pre_mean']     = pre_mean[index]
+        arr['post_mean']    = np.where(dots.index[index, 2] > 0, post_mean[index], -99)
+        arr['n_pre_dots']   = dots.index[index, 1] // arr['dots_per_frame'] # bees of one dot are consecutive in the store
+        arr['n_post_dots']  = dots.index[index, 2] // arr['dots_per_frame']
+    elif 'pre_dots_location' in rows[0]:
+        # older data files with string-encoded dot lists (parsed once, here)
+        for i, row in enumerate(rows):
+            pre, post               = legacy_dots(row['pre_dots_location']), legacy_dots(row['post_dots_location'])
+            arr['n_pre_dots'][i]    = len(pre)
+            arr['n_post_dots'][i]   = len(post)
+            arr['pre_mean'][i]      = pre.mean() if len(pre) else -99
+            arr['post_mean'][i]     = post.mean() if len(post) else -99
+
+    return add_features(arr)
+
+
+def add_features(arr):
+    # previous-trial variables (only within a block and when the previous trial had a response)
+    valid                       = np.zeros(len(arr), dtype=bool)
+    valid[1:]                   = (arr['block'][1:] == arr['block'][:-1]) & (arr['sub'][1:] == arr['sub'][:-1]) & (arr['response_right'][:-1] >= 0)
+    arr['prev_valid']           = valid
+
+    for feature, source in (('prev_response_right', 'response_right'), ('prev_accuracy', 'accuracy'),
+                            ('prev_cj', 'cj'), ('prev_stronger', 'stronger'), ('prev_shift', 'shift')):
+        previous                = np.full(len(arr), -99, dtype=arr.dtype[feature])
+        previous[1:]            = arr[source][:-1]
+        arr[feature]            = np.where(valid, previous, -99)
+
+    arr['repeat']               = np.where(valid & (arr['response_right'] >= 0), arr['response_right'] == arr['prev_response_right'], -99)
+    return arr
+
+
+def _convert(job):
+    csv_file, npy_file = job
+    arr = ingest_subject(csv_file)
+    np.save(npy_file, arr)
+    return csv_file, len(arr)
+
+
+def update_store(data_dir='Data', store_dir=None, workers=None):
+    # converts new or changed subject files, returns the number of converted files
+    store_dir       = store_dir or os.path.join(data_dir, 'store')
+    manifest_file   = os.path.join(store_dir, 'manifest.json')
+    os.makedirs(store_dir, exist_ok=True)
+
+    manifest = {}
+    if os.path.isfile(manifest_file):
+        with open(manifest_file) as f:
+            manifest = json.load(f)
+
+    jobs = []
+    for csv_file in sorted(glob.glob(os.path.join(data_dir, 'DotsTask_sub*.csv'))):
+        stat    = os.stat(csv_file)
+        version = [stat.st_size, stat.st_mtime, store_format]
+        name    = os.path.basename(csv_file)
+        if manifest.get(name) != version:
+            jobs.append((csv_file, os.path.join(store_dir, os.path.splitext(name)[0] + '.npy')))
+            manifest[name] = version
+
+    if jobs:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for csv_file, n_trials in pool.map(_convert, jobs):
+                print('%s: %d trials' % (csv_file, n_trials))
+
+        temp_file = manifest_file + '.tmp'
+        with open(temp_file, 'w') as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(temp_file, manifest_file)
+    return len(jobs)
+
+
+def load_store(store_dir=os.path.join('Data', 'store')):
+    arrays = [np.load(npy_file, mmap_mode='r') for npy_file in sorted(glob.glob(os.path.join(store_dir, 'DotsTask_sub*.npy')))]
+    return np.concatenate(arrays) if arrays else np.zeros(0, dtype=trial_dtype)
+
+
+def sequential_effects(trials, high=(5,6), low=(1,2)):
+    # per subject: P(repeat | previous confidence high) and P(repeat | previous confidence low)
+    defined     = trials['repeat'] >= 0
+    prev_high   = defined & np.isin(trials['prev_cj'], high)
+    prev_low    = defined & np.isin(trials['prev_cj'], low)
+    subjects, index = np.unique(trials['sub'], return_inverse=True)
+
+    def rate(mask):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.bincount(index, weights=mask & (trials['repeat'] == 1), minlength=len(subjects)) / np.bincount(index, weights=mask, minlength=len(subjects))
+
+    return subjects, rate(prev_high), rate(prev_low)
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert subject files into the analysis store and summarise sequential effects')
+    parser.add_argument('--data', default='Data', help='folder with the DotsTask_subN.csv files')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes (default: number of cores)')
+    args = parser.parse_args()
+
+    n_new       = update_store(args.data, workers=args.workers)
+    trials      = load_store(os.path.join(args.data, 'store'))
+    print('%d new subject files, %d trials in store' % (n_new, len(trials)))
+
+    if len(trials):
+        subjects, repeat_high, repeat_low = sequential_effects(trials[trials['main']])
+        for s, h, l in zip(subjects, repeat_high, repeat_low):
+            print('sub %d: P(repeat | high confidence) = %.3f   P(repeat | low confidence) = %.3f' % (s, h, l))
+        print('Mean difference (high - low): %.3f' % np.nanmean(repeat_high - repeat_low))
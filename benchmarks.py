@@ -0,0 +1,331 @@
+"""
+Headless benchmarks of the hot paths of the Beehives Paradigm
+
+- Runs the trial loop of the experiment script without a display: the work in between flips is the same code
+  (trial_runner.py: dot sampling, static screens, dots with a keyboard check after every frame, data of the trial,
+  break_texts, profiler hooks), only window, stimuli and keyboard are mocks. The mock window counts draw and flip calls,
+  the mock keyboard answers after a random number of frames. Everything else is the real code
+  (design.py schedule, DotSampler, DotField, EvidenceAccumulator, FrameTimer, ResponseCollector, TrialWriter, DotStore, checkpoints).
+- Measured per operation (latency of the code between two flips, the flip itself returns immediately):
+    dot_sampling    all dots of a trial (before the first flip of the trial)
+    frame           code in between two flips of a trial: draw calls, bee update, evidence, flip bookkeeping, keyboard check
+    response_poll   the keyboard check of a frame (included in frame)
+    trial_record    saving a trial: data of all columns, dot store, nextEntry, checkpoint hand-over
+    block_break     end of a main block: block summary and flush of the writer (while the break screen is on)
+    session_save    end of session: writer and dot store closed (everything on disk)
+- Full sessions (all trials of the default design, up to 50 dots per trial) in a temporary folder,
+  optionally with several bees per dot and trails (--dots-per-frame, --trail-length).
+- Reports percentiles per operation, compares them with a baseline file and fails (exit code 1)
+  when an operation that runs in between flips exceeds the frame budget or is much slower than the baseline.
+
+Usage: python benchmarks.py [--sessions 3] [--baseline Data/benchmarks_baseline.json] [--save-baseline]
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+import numpy as np
+
+import design
+import task_logic
+from checkpoint import Checkpoint
+from dot_field import DotField
+from dot_sampler import DotSampler
+from dot_store import DotStore
+from frame_timing import FrameTimer, FIXATION, BEEHIVES, BLANK, FEEDBACK, CONFIDENCE, TIMEOUT, ITI
+from profiling import Profiler
+from responses import ResponseCollector
+from timeline import compile_timeline, max_flips
+from trial_runner import TrialRunner, break_texts
+from trial_writer import TrialWriter
+
+
+# Design (durations, dots) from design.default_config, keys as in BeehivesParadigm_2023_01.py
+config      = design.default_config
+timeline_ms, width, width_add, max_dots, add_dots = (config[key] for key in ('timeline_ms', 'width', 'width_add', 'max_dots', 'add_dots'))
+choice_keys = ['c','n']
+cj_keys     = ['1','2','3','8','9','0']
+
+frame_ops   = ('dot_sampling', 'frame', 'response_poll', 'trial_record') # run in between two flips
+
+
+
+#########
+# Mocks #
+#########
+
+class MockWindow:
+
+    def __init__(self):
+        self.n_flips    = 0
+        self.n_draws    = 0
+        self.on_flip    = []
+        self.last_flip  = None # None: the time until the next flip is not a frame (start of a trial, saving)
+        self.frame_times = []  # time in between two flips
+
+    def callOnFlip(self, function, *args):
+        self.on_flip.append((function, args))
+
+    def flip(self):
+        if self.last_flip is not None:
+            self.frame_times.append(perf_counter() - self.last_flip)
+        for function, args in self.on_flip:
+            function(*args)
+        self.on_flip    = []
+        self.n_flips   += 1
+        self.last_flip  = perf_counter()
+        return self.last_flip
+
+
+
+class MockStim:
+
+    def __init__(self, window):
+        self.window = window
+        self.pos    = (0, 0)
+
+    def draw(self):
+        self.window.n_draws += 1
+
+
+
+class MockClock:
+
+    def __init__(self):
+        self.start = perf_counter()
+
+    def reset(self):
+        self.start = perf_counter()
+
+    def getTime(self):
+        return perf_counter() - self.start
+
+
+
+class MockKey:
+
+    def __init__(self, name, rt):
+        self.name   = name
+        self.rt     = rt
+        self.tDown  = rt
+
+
+
+class MockKeyboard:
+    # answers with 'key' on the answer_at-th call of getKeys (None: no answer)
+
+    def __init__(self):
+        self.clock      = MockClock()
+        self.answer_at  = None
+        self.key        = None
+        self.n_polls    = 0
+
+    def clearEvents(self):
+        self.n_polls    = 0
+
+    def getKeys(self, keyList=None, waitRelease=False, clear=True):
+        self.n_polls += 1
+        if self.n_polls == self.answer_at:
+            return [MockKey(self.key, self.clock.getTime())]
+        return []
+
+    def waitKeys(self, keyList=None, waitRelease=False, clear=True):
+        return [MockKey(keyList[0], self.clock.getTime())]
+
+
+
+##############
+# Benchmarks #
+##############
+
+def timed(function, values):
+    # function that also appends its latency to values
+    def wrapper(*args):
+        start   = perf_counter()
+        result  = function(*args)
+        values.append(perf_counter() - start)
+        return result
+    return wrapper
+
+
+def run_session(folder, session, frame_ms, rng, dots_per_frame=1, trail_length=0):
+    # one full session, returns the latencies (s) of every operation and the number of draw/flip calls
+    times       = {name: [] for name in frame_ops + ('block_break', 'session_save')}
+    window      = MockWindow()
+    scene       = MockStim(window)
+    multi_dots  = dots_per_frame > 1 or trail_length > 0
+    bee         = DotField(window, dots_per_frame, trail_length, stim=MockStim(window)) if multi_dots else MockStim(window)
+    device      = MockKeyboard()
+    responses   = ResponseCollector(window, device)
+    responses.poll = timed(responses.poll, times['response_poll'])
+    frames      = compile_timeline(timeline_ms, frame_ms)
+    timer       = FrameTimer(window, frame_ms, max_flips(frames, max_dots, add_dots))
+    sampler     = DotSampler(session, width, width_add, max_dots, add_dots, seed=session, dots_per_frame=dots_per_frame)
+    runner      = TrialRunner(scene, bee, timer, responses, sampler, Profiler(), frames, choice_keys, width, multi_dots)
+    schedule    = design.compile_schedule(config, session, session)
+    block_sizes = np.bincount(schedule['block'])
+    nb_total    = len(block_sizes)
+    block_worker = ThreadPoolExecutor(max_workers=1)
+
+    file_name   = os.path.join(folder, 'DotsTask_sub%d' % session)
+    dot_store   = DotStore(file_name)
+    checkpoint  = Checkpoint(file_name)
+    writer      = TrialWriter(file_name, extraInfo={'sub': session, 'age': 30, 'gender': 'X', 'handedness': 'R',
+                                                     'dots_per_frame': dots_per_frame, 'trail_length': trail_length}, sync_also=[dot_store, checkpoint])
+
+    feedback_acc, feedback_rt, prev_feedback_acc, prev_feedback_rt, break_job = [], [], [], [], None
+    for trial in schedule:
+        block               = int(trial['block'])
+        # the keyboard answers after a random number of frames (about 5% time-outs)
+        device.answer_at    = None if rng.random() < 0.05 else int(rng.integers(2, max_dots * frames['dot']))
+        device.key          = choice_keys[int(rng.integers(2))]
+
+        # same steps as a trial of the experiment script
+        window.last_flip    = None
+        start               = perf_counter()
+        difficulty          = int(trial['difficulty'])
+        mean                = [int(task_logic.generative_mean(difficulty, trial['target_right'])), 0]
+        runner.start_trial(mean, difficulty, block, int(trial['trial']), trial['seed'])
+        times['dot_sampling'].append(perf_counter() - start)
+
+        runner.show_scene(scene, FIXATION, frames['fixation'])
+        runner.show_scene(scene, BEEHIVES, frames['beehives'])
+        key = runner.pre_decision()
+        if key is not None:
+            runner.post_decision(trial['stronger'], int(trial['shift']))
+        response, rt, key_time, accuracy = runner.outcome()
+        if key is not None:
+            feedback_acc.append(accuracy)
+            feedback_rt.append(rt)
+        else: # time-out slide (waits for space)
+            scene.draw()
+            timer.flip(TIMEOUT)
+            timer.gap()
+
+        runner.show_scene(None, BLANK, frames['blank'])
+        if not trial['main'] and key is not None:
+            runner.show_scene(scene, FEEDBACK, frames['feedback'])
+
+        cj, RTconf = -99, -99
+        if trial['confidence'] and key is not None:
+            scene.draw()
+            responses.clear()
+            responses.reset_clock_on_flip()
+            timer.flip(CONFIDENCE)
+            conf_press  = responses.wait(cj_keys).name
+            RTconf      = responses.key.rt
+            timer.gap()
+            cj          = int(task_logic.confidence_rating(cj_keys.index(conf_press), session))
+
+        break_block = trial['main'] and block < nb_total - 1 and trial['trial'] == block_sizes[block]
+        if break_block and feedback_rt:
+            break_job = block_worker.submit(break_texts, list(feedback_acc), list(feedback_rt), nb_total - (block+1), prev_feedback_acc, prev_feedback_rt, block == 1)
+        runner.show_scene(None, ITI, frames['iti'])
+
+        # saving the trial
+        window.last_flip    = None
+        start               = perf_counter()
+        runner.record(writer, dot_store, trial, 'main' if trial['main'] else 'practice', config['dif_lvl'].index(difficulty), -99, cj, RTconf)
+        writer.nextEntry()
+        writer.call(checkpoint.save, {
+            'block': block, 'trial': int(trial['trial']), 'rows': writer.n_entries, 'dots': dot_store.n_dots, 'durations': dot_store.n_durations,
+            'dot_seed': sampler.seed, 'prev_feedback_acc': prev_feedback_acc, 'prev_feedback_rt': prev_feedback_rt,
+            'feedback_acc': list(feedback_acc), 'feedback_rt': list(feedback_rt), 'psychometric': None})
+        times['trial_record'].append(perf_counter() - start)
+        timer.flip(ITI)
+
+        # end of a main block: summary and all trials on disk (break screen)
+        if break_block:
+            start = perf_counter()
+            if break_job is None:
+                break_job = block_worker.submit(break_texts, list(feedback_acc), list(feedback_rt), nb_total - (block+1), prev_feedback_acc, prev_feedback_rt, block == 1)
+            prev_feedback_rt, prev_feedback_acc, texts = break_job.result()
+            writer.flush()
+            times['block_break'].append(perf_counter() - start)
+            break_job = None
+        if trial['trial'] == block_sizes[block]:
+            feedback_acc, feedback_rt = [], []
+
+    start = perf_counter()
+    writer.close()
+    dot_store.close()
+    times['session_save'].append(perf_counter() - start)
+    block_worker.shutdown()
+    times['frame'] = window.frame_times
+    return times, window.n_draws, window.n_flips, len(schedule)
+
+
+def summarise(times):
+    summary = {}
+    for name, values in times.items():
+        ms              = np.asarray(values) * 1000
+        summary[name]   = {'n': len(ms), 'p50': np.percentile(ms, 50), 'p95': np.percentile(ms, 95),
+                           'p99': np.percentile(ms, 99), 'max': ms.max()}
+    return summary
+
+
+def check(summary, baseline, budget_ms, tolerance, floor_ms=0.05):
+    # returns the list of failures: frame budget exceeded (p99) or slower than the baseline (p95)
+    failures = []
+    for name, stats in summary.items():
+        if name in frame_ops and stats['p99'] > budget_ms:
+            failures.append('%s: p99 %.3f ms exceeds the frame budget of %.1f ms' % (name, stats['p99'], budget_ms))
+        if baseline and name in baseline:
+            reference = baseline[name]['p95']
+            if stats['p95'] > reference * (1 + tolerance) and stats['p95'] - reference > floor_ms:
+                failures.append('%s: p95 %.3f ms vs. %.3f ms in the baseline (+%.0f%%)' % (name, stats['p95'], reference, 100 * (stats['p95'] / reference - 1)))
+    return failures
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Headless benchmarks of the trial loop and the data saving')
+    parser.add_argument('--sessions', type=int, default=3, help='number of full sessions')
+    parser.add_argument('--frame-ms', type=float, default=1000/60, help='frame duration (budget of the operations in between flips)')
+    parser.add_argument('--baseline', default=os.path.join('Data', 'benchmarks_baseline.json'))
+    parser.add_argument('--save-baseline', action='store_true', help='save the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='allowed slow-down compared to the baseline (0.5: 50%%)')
+    parser.add_argument('--dots-per-frame', type=int, default=1, help='bees shown at the same time (dot_field.py)')
+    parser.add_argument('--trail-length', type=int, default=0, help='previous dots that stay visible (dot_field.py)')
+    args = parser.parse_args()
+
+    rng     = np.random.default_rng(1)
+    times   = {}
+    with tempfile.TemporaryDirectory() as folder:
+        for session in range(args.sessions):
+            session_times, n_draws, n_flips, n_trials = run_session(folder, session + 1, args.frame_ms, rng, args.dots_per_frame, args.trail_length)
+            for name, values in session_times.items():
+                times.setdefault(name, []).extend(values)
+            print('session %d: %d trials, %d flips, %d draw calls (%.1f draws per flip)' % (session + 1, n_trials, n_flips, n_draws, n_draws / n_flips))
+
+    summary = summarise(times)
+    print('\n%-15s %8s %9s %9s %9s %9s' % ('operation', 'n', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms'))
+    for name, stats in summary.items():
+        print('%-15s %8d %9.3f %9.3f %9.3f %9.3f' % (name, stats['n'], stats['p50'], stats['p95'], stats['p99'], stats['max']))
+
+    baseline = None
+    if os.path.isfile(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    failures = check(summary, baseline, args.frame_ms, args.tolerance)
+    if baseline is None:
+        print('\nNo baseline in %s (run with --save-baseline)' % args.baseline)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline) or '.', exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            json.dump(summary, f, indent=1)
+        print('Baseline saved in %s' % args.baseline)
+
+    if failures:
+        print('\nFAILED')
+        for failure in failures:
+            print('  ' + failure)
+        sys.exit(1)
+    print('\nOK')
@@ -0,0 +1,93 @@
+"""
+Checkpoints to resume an interrupted session of the Beehives Paradigm
+
+- After every trial the session state (block, trial, feedback variables, number of trials/dots on disk)
+  is saved in <file_name>_checkpoint.pkl. The trial order, shifts and dot seeds are in the schedule file (design.py).
+- The checkpoint is written by the trial writer thread once its trial is flushed (never ahead of the data after a crash
+  of the script), to a temporary file that replaces the old checkpoint, so there is always one complete checkpoint.
+  It is fsync'ed together with the data files every fsync_every trials (Checkpoint in sync_also of the trial writer).
+- After a power cut the checkpoint can be ahead of the data on disk: resuming is then refused instead of
+  padding the dot store with zeros.
+- On --resume the data files are cut back to what the checkpoint describes (a trial that was written
+  but whose checkpoint was not is presented again) and the session continues with the next trial.
+- A session that stopped before its first trial was written (no checkpoint, csv file without rows) has not
+  started (session_started): the subject number can be used again without --resume.
+"""
+
+import csv
+import os
+import pickle
+
+from dot_store import store_files, duration_files, INDEX_DTYPE, COORD_DTYPE, DURATION_DTYPE
+
+
+def checkpoint_file(file_name):
+    return file_name + '_checkpoint.pkl'
+
+
+def session_started(file_name):
+    # True when a trial of this session was written: a checkpoint or at least one row below the header of the csv file
+    if os.path.isfile(checkpoint_file(file_name)):
+        return True
+    csv_name = file_name + '.csv'
+    if not os.path.isfile(csv_name):
+        return False
+    with open(csv_name, newline='') as f:
+        return sum(1 for _ in zip(range(2), csv.reader(f))) > 1
+
+
+def save_checkpoint(path, state):
+    temp_name = path + '.tmp'
+    with open(temp_name, 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_name, path)
+
+
+
+class Checkpoint:
+    # checkpoint of a session: save() is run by the trial writer thread (writer.call), flush()/sync() as sync_also of the writer
+
+    def __init__(self, file_name):
+        self.path = checkpoint_file(file_name)
+
+    def save(self, state):
+        save_checkpoint(self.path, state)
+
+    def flush(self):
+        pass # save() closes the file
+
+    def sync(self):
+        if os.path.isfile(self.path):
+            fd = os.open(self.path, os.O_RDWR)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+
+
+def load_checkpoint(path):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def truncate_session(file_name, state):
+    # csv file: header + the trials of the checkpoint
+    csv_name = file_name + '.csv'
+    with open(csv_name, newline='') as f:
+        rows = list(csv.reader(f))
+    coords_name, index_name = store_files(file_name)
+    if len(rows) - 1 < state['rows'] or os.path.getsize(coords_name) < state['dots'] * 2 * COORD_DTYPE().itemsize:
+        raise ValueError('The data files have fewer trials than the checkpoint (%d), they were not all written to disk' % state['rows'])
+    with open(csv_name, 'w', newline='') as f:
+        csv.writer(f).writerows(rows[:state['rows'] + 1])
+
+    # dot store: coordinates and index of the trials of the checkpoint
+    os.truncate(coords_name, state['dots'] * 2 * COORD_DTYPE().itemsize)
+    os.truncate(index_name, state['rows'] * 3 * INDEX_DTYPE().itemsize)
+
+    # dot durations (not in checkpoints of sessions from before they were stored)
+    durations_name, durations_index_name = duration_files(file_name)
+    if 'durations' in state and os.path.isfile(durations_index_name):
+        os.truncate(durations_name, state['durations'] * DURATION_DTYPE().itemsize)
+        os.truncate(durations_index_name, state['rows'] * 3 * INDEX_DTYPE().itemsize)
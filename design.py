@@ -0,0 +1,252 @@
+"""
+Design compiler of the Beehives Paradigm
+
+- The design (number of blocks/trials, difficulty levels, shifts, ...) is read from a json config file
+  (missing entries: default_config, same values as the experiment script).
+- The config also has the dots (width, max_dots, ...) and the durations (timeline_ms) of the session. It is saved with the
+  schedule, so replay, simulation, benchmarks and model fit read them from there (session_config) or from default_config.
+- The whole session is compiled into one numpy structured array (one row per trial):
+  block, trial, main/practice, difficulty, target, postDecisionEvi, shift, confidence on/off and the seed of the dots.
+- Main blocks: the 16 trial types (difficulty x target x postDecisionEvi) repeated to the block length,
+  every block shuffled on its own, with at most max_target_run trials in a row on the same side.
+  Practice block: only the three easiest levels, drawn at random.
+- Schedules are checked after compiling (balancing within every main block, run lengths) and saved as
+  Data/DotsTask_subN_schedule.npz, which the experiment script loads at startup when it exists.
+- Everything is vectorized over subjects, so schedules for many subjects (or for the simulation) are compiled at once.
+
+Usage: python design.py --subjects 1-40 [--config design.json] [--out Data] [--seed 1]
+"""
+
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+import task_logic
+
+
+default_config = {
+    'nb_training_blocks':   1,
+    'nb_training_trials':   10,
+    'nb_main_blocks':       7,
+    'nb_main_trials_block': 64,
+    'nb_conf_blocks':       6,
+    'dif_lvl':              [1,6,18,80],
+    'practice_levels':      [1,2,3],            # index in dif_lvl of the levels in the practice block
+    'shift':                [10,20,30,40,50,60], # shuffled for every subject, one value per main block after the first
+    'max_target_run':       6,                  # maximum number of trials in a row with the same target side (main blocks)
+    'pilot':                False,              # main blocks as long as the practice block, trial types drawn at random
+    'width':                70,                 # width of the sampling distribution of the dots (pixels)
+    'width_add':            30,                 # width of the post-decisional dots
+    'max_dots':             50,                 # response deadline is timeline_ms['dot'] * max_dots
+    'add_dots':             5,                  # post-decisional dots after a response
+    'timeline_ms':          {'fixation': 750, 'beehives': 750, 'dot': 100, 'blank': 500, 'feedback': 1000, 'iti': 250},
+}
+
+schedule_dtype = np.dtype([
+    ('block',           np.int16),
+    ('trial',           np.int16),  # 1..number of trials in the block
+    ('main',            np.bool_),  # False: practice
+    ('difficulty',      np.int16),  # distance of the generative mean from the center (pixels)
+    ('target_right',    np.bool_),
+    ('stronger',        np.bool_),  # postDecisionEvi 'stronger' (True) or 'weaker'
+    ('shift',           np.int16),  # shift of the post-decisional mean (0 in practice and first main block)
+    ('confidence',      np.bool_),  # confidence is asked
+    ('seed',            np.uint32), # seed of the dots of this trial
+])
+
+
+class DesignError(ValueError):
+    pass
+
+
+def load_config(config_file=None):
+    config = dict(default_config)
+    if config_file is not None:
+        with open(config_file) as f:
+            config.update(json.load(f))
+    return config
+
+
+def validate_config(config):
+    config      = dict(default_config, **config)
+    config['timeline_ms'] = dict(default_config['timeline_ms'], **config['timeline_ms']) # a config file can change single durations
+    n_types     = len(config['dif_lvl']) * len(task_logic.target_side) * len(task_logic.post_evi)
+    problems    = []
+    if config['nb_main_trials_block'] % n_types != 0:
+        problems.append('Number of trials per block (%d) is not dividable by %d' % (config['nb_main_trials_block'], n_types))
+    if len(config['shift']) < config['nb_main_blocks'] - 1:
+        problems.append('%d shift values for %d main blocks (one per main block after the first)' % (len(config['shift']), config['nb_main_blocks']))
+    if config['nb_conf_blocks'] > config['nb_main_blocks']:
+        problems.append('More confidence blocks (%d) than main blocks (%d)' % (config['nb_conf_blocks'], config['nb_main_blocks']))
+    if any(d != int(d) or d <= 0 for d in config['dif_lvl']) or any(s != int(s) for s in config['shift']):
+        problems.append('Difficulty levels and shifts have to be whole (positive) numbers of pixels')
+    if any(not 0 <= level < len(config['dif_lvl']) for level in config['practice_levels']):
+        problems.append('practice_levels has to contain indices in dif_lvl')
+    if config['max_target_run'] < 2:
+        problems.append('max_target_run has to be at least 2')
+    if min(config['width'], config['width_add'], config['max_dots'], config['add_dots']) <= 0 or min(config['timeline_ms'].values()) <= 0:
+        problems.append('Widths, numbers of dots and durations have to be positive')
+    if problems:
+        raise DesignError('\n'.join(problems))
+    return config
+
+
+def block_lengths(config):
+    main_length = config['nb_training_trials'] if config['pilot'] else config['nb_main_trials_block']
+    return [config['nb_training_trials']] * config['nb_training_blocks'] + [main_length] * config['nb_main_blocks']
+
+
+def trial_types(config):
+    # difficulty x target x postDecisionEvi, in the same order as the original trial list
+    diff, right, strong = np.meshgrid(config['dif_lvl'], [False, True], [True, False], indexing='ij')
+    return diff.ravel(), right.ravel(), strong.ravel()
+
+
+def longest_run_exceeds(values, max_run):
+    # rows of values (n_rows, n) with more than max_run equal values in a row
+    if values.shape[1] <= max_run:
+        return np.zeros(len(values), dtype=bool)
+    same = values[:, 1:] == values[:, :-1]
+    return np.lib.stride_tricks.sliding_window_view(same, max_run, axis=1).all(axis=-1).any(axis=-1)
+
+
+def _shuffle(rng, n_rows, types, n, max_run, max_attempts=1000):
+    # n trials out of the (repeated) trial types, shuffled for every row, resampled until the run length is fine
+    repeated    = np.resize(np.arange(len(types[0])), n) if n % len(types[0]) == 0 else None
+    order       = np.empty((n_rows, n), dtype=np.int64)
+    todo        = np.arange(n_rows)
+    for attempt in range(max_attempts):
+        if repeated is not None: # balanced: every type equally often
+            candidate = repeated[np.argsort(rng.random((len(todo), n)), axis=1)]
+        else: # pilot: types drawn at random
+            candidate = rng.integers(len(types[0]), size=(len(todo), n))
+        order[todo] = candidate
+        todo        = todo[longest_run_exceeds(types[1][candidate], max_run)]
+        if len(todo) == 0:
+            return order
+    raise DesignError('No trial order with at most %d trials in a row on the same side after %d attempts' % (max_run, max_attempts))
+
+
+def compile_schedule(config, sub, seed):
+    # sub: one subject number (returns (trials,)) or an array of subject numbers (returns (subjects, trials))
+    config      = validate_config(config)
+    subs        = np.atleast_1d(sub)
+    rng         = np.random.default_rng(np.random.SeedSequence(seed, spawn_key=tuple(int(s) for s in subs)))
+    lengths     = block_lengths(config)
+    schedule    = np.zeros((len(subs), sum(lengths)), dtype=schedule_dtype)
+
+    types       = trial_types(config)
+    levels      = np.repeat(np.arange(len(config['dif_lvl'])), len(types[0]) // len(config['dif_lvl'])) # index in dif_lvl of every trial type
+    practice    = tuple(t[np.isin(levels, config['practice_levels'])] for t in types)
+    shifts      = np.take(config['shift'], np.argsort(rng.random((len(subs), len(config['shift']))), axis=1))
+    nb_total    = len(lengths)
+
+    start = 0
+    for block, n in enumerate(lengths):
+        rows                = schedule[:, start:start + n]
+        main                = block >= config['nb_training_blocks']
+        if main:
+            order           = _shuffle(rng, len(subs), types, n, config['max_target_run'])
+            block_types     = types
+        else: # practice: levels, sides and post-decisional evidence drawn at random
+            order           = rng.integers(len(practice[0]), size=(len(subs), n))
+            block_types     = practice
+        rows['block']       = block
+        rows['trial']       = np.arange(1, n + 1)
+        rows['main']        = main
+        rows['difficulty']  = block_types[0][order]
+        rows['target_right']= block_types[1][order]
+        rows['stronger']    = block_types[2][order]
+        rows['shift']       = shifts[:, block - config['nb_training_blocks'] - 1, None] if block > config['nb_training_blocks'] else 0
+        rows['confidence']  = task_logic.is_confidence_block(block, nb_total, config['nb_conf_blocks'])
+        start              += n
+
+    schedule['seed'] = rng.integers(2**32, size=schedule.shape, dtype=np.uint64)
+    check_schedule(schedule, config)
+    return schedule[0] if np.ndim(sub) == 0 else schedule
+
+
+def check_schedule(schedule, config):
+    # raises DesignError when a schedule (or several: (subjects, trials)) does not follow the design
+    config      = validate_config(config)
+    schedule    = np.atleast_2d(schedule)
+    problems    = []
+    if schedule.shape[1] != sum(block_lengths(config)):
+        problems.append('%d trials instead of %d' % (schedule.shape[1], sum(block_lengths(config))))
+
+    diff, right, strong = trial_types(config)
+    type_code   = lambda d, r, s: np.searchsorted(np.sort(config['dif_lvl']), d) * 4 + r * 2 + s
+    for block in range(config['nb_training_blocks'], config['nb_training_blocks'] + config['nb_main_blocks']):
+        rows        = schedule[:, schedule[0]['block'] == block]
+        if not config['pilot']: # every trial type equally often
+            reference   = np.sort(np.resize(type_code(diff, right, strong), rows.shape[1]))
+            codes       = np.sort(type_code(rows['difficulty'], rows['target_right'], rows['stronger']), axis=1)
+            if not (codes == reference).all():
+                problems.append('Block %d is not balanced' % block)
+        if longest_run_exceeds(rows['target_right'], config['max_target_run']).any():
+            problems.append('Block %d has more than %d trials in a row on the same side' % (block, config['max_target_run']))
+        if (rows['shift'] != rows['shift'][:, :1]).any():
+            problems.append('Shift changes within block %d' % block)
+    if problems:
+        raise DesignError('\n'.join(problems))
+
+
+def schedule_file(file_name):
+    return file_name + '_schedule.npz'
+
+
+def save_schedule(path, schedule, seed, config):
+    np.savez(path, schedule=schedule, seed=np.uint64(seed), config=json.dumps(config))
+
+
+def load_schedule(path):
+    # returns the schedule, the seed it was compiled with and its config
+    with np.load(path) as f:
+        return f['schedule'], int(f['seed']), json.loads(str(f['config']))
+
+
+def session_config(file_name):
+    # config of a session (file_name without .csv): saved with its schedule, default_config for what it does not have
+    path = schedule_file(file_name)
+    if not os.path.isfile(path):
+        return dict(default_config)
+    return validate_config(load_schedule(path)[2])
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compile, check and save the schedules of many subjects')
+    parser.add_argument('--subjects', default='1-40', help='subject numbers, e.g. 1-40 or 3,5,8')
+    parser.add_argument('--config', default=None, help='json file with the design (default: default_config)')
+    parser.add_argument('--out', default='Data', help='folder of the schedules (the experiment script looks in Data)')
+    parser.add_argument('--seed', type=int, default=None, help='seed (default: new seed for every subject)')
+    parser.add_argument('--check-only', action='store_true', help='only compile and check, do not save')
+    args = parser.parse_args()
+
+    if '-' in args.subjects:
+        first, last = map(int, args.subjects.split('-'))
+        subjects    = range(first, last + 1)
+    else:
+        subjects    = [int(s) for s in args.subjects.split(',')]
+
+    try:
+        config = validate_config(load_config(args.config))
+    except ValueError as error: # DesignError or a json file that cannot be read
+        sys.exit('Invalid design: %s' % '; '.join(str(error).splitlines()))
+    os.makedirs(args.out, exist_ok=True)
+    for sub in subjects:
+        seed        = args.seed if args.seed is not None else int(np.random.SeedSequence().entropy % 2**32)
+        try:
+            schedule = compile_schedule(config, sub, seed)
+        except ValueError as error: # no schedule within the constraints
+            sys.exit('sub %d: %s' % (sub, '; '.join(str(error).splitlines())))
+        if not args.check_only:
+            path    = schedule_file(os.path.join(args.out, 'DotsTask_sub%d' % sub))
+            if os.path.isfile(path):
+                print('%s already exists, not overwritten' % path)
+                continue
+            save_schedule(path, schedule, seed, config)
+        print('sub %d: %d trials, seed %d' % (sub, len(schedule), seed))
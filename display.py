@@ -0,0 +1,22 @@
+"""
+Screen size detection without platform-specific packages
+
+- Windows: GetSystemMetrics through ctypes (no win32api/pywin32 needed)
+- Other platforms: the default screen of pyglet (PsychoPy's window backend)
+"""
+
+import sys
+
+
+def get_screen_size():
+    if sys.platform == 'win32':
+        import ctypes
+        user32 = ctypes.windll.user32 # same call as win32api.GetSystemMetrics (same DPI scaling)
+        return user32.GetSystemMetrics(0), user32.GetSystemMetrics(1)
+
+    import pyglet
+    try:
+        screen = pyglet.canvas.get_display().get_default_screen() # pyglet 1.x
+    except AttributeError:
+        screen = pyglet.display.get_display().get_default_screen() # pyglet 2.x
+    return screen.width, screen.height
@@ -0,0 +1,66 @@
+"""
+Dot field renderer for variants of the Beehives Paradigm with several bees at once and/or fading trails
+
+- All bees on screen are elements of one ElementArrayStim, so a frame needs one draw call however many bees there are
+  (the original single bee is a visual.Circle that is moved for every dot).
+- set_dots() takes the positions of one dot step straight from the sampler arrays (dots_per_frame x 2) and uploads
+  positions and opacities once per dot step (not every frame). Positions are shifted in place through a preallocated
+  scratch array and the opacities are rows of a table made at the start, so DotField allocates nothing per dot
+  (PsychoPy copies the arrays when they are uploaded).
+- With trail_length > 0 the bees of the previous trail_length dot steps stay visible with decreasing opacity
+  (newest 1, oldest 1/(trail_length+1)), older bees are drawn first so the newest are on top.
+- The bees of one dot step are saved as consecutive dots, dots_per_frame and trail_length are saved with the data
+  (replay.py and analysis.py group them again).
+- clear() at the start of a trial removes the trail of the previous trial.
+"""
+
+import numpy as np
+
+
+class DotField:
+
+    def __init__(self, window, dots_per_frame=1, trail_length=0, size=10, color=(1,1,1), stim=None):
+        # stim: object with the ElementArrayStim interface (xys, opacities, draw), e.g. a mock in benchmarks.py
+        self.dots_per_frame = dots_per_frame
+        self.trail_length   = trail_length
+        n_steps             = trail_length + 1
+
+        self.xys            = np.zeros((n_steps, dots_per_frame, 2), dtype=np.float64) # in drawing order: oldest dot step first, newest last
+        self.flat_xys       = self.xys.reshape(-1, 2)                                  # view, (n_steps * dots_per_frame, 2)
+        self.scratch        = np.zeros((n_steps - 1, dots_per_frame, 2), dtype=np.float64)
+
+        # opacities in drawing order when n dot steps have been shown in this trial (row n): age 0 has opacity 1, age trail_length 1/(trail_length+1)
+        step_opacity        = np.linspace(1, 0, n_steps + 1)[:-1]
+        self.opacity_table  = np.zeros((n_steps + 1, n_steps, dots_per_frame), dtype=np.float64)
+        for n in range(1, n_steps + 1):
+            self.opacity_table[n, n_steps - n:] = step_opacity[:n][::-1, None]
+        self.opacity_table  = self.opacity_table.reshape(n_steps + 1, -1)
+        self.n_shown        = 0 # dot steps shown in this trial (trail is empty at the start of a trial)
+
+        if stim is None:
+            from psychopy import visual
+            stim = visual.ElementArrayStim(window, units='pix', nElements=n_steps * dots_per_frame, sizes=size,
+                                           xys=self.flat_xys, colors=color, colorSpace='rgb',
+                                           opacities=self.opacity_table[0], elementTex=None, elementMask='circle')
+        self.stim           = stim
+
+
+    def clear(self):
+        self.n_shown        = 0
+        self.stim.opacities = self.opacity_table[0]
+
+
+    def set_dots(self, dots):
+        # dots: (dots_per_frame, 2) or one (x,y) position
+        np.copyto(self.scratch, self.xys[1:]) # trail moves one step back (the slices overlap, so through the scratch array)
+        np.copyto(self.xys[:-1], self.scratch)
+        self.xys[-1]        = dots
+        self.n_shown        = min(self.n_shown + 1, self.trail_length + 1)
+
+        # oldest first: drawn first, so the newest bees are on top
+        self.stim.xys       = self.flat_xys
+        self.stim.opacities = self.opacity_table[self.n_shown]
+
+
+    def draw(self):
+        self.stim.draw()
@@ -0,0 +1,55 @@
+"""
+Dot sampling engine for the Beehives Paradigm
+
+- All pre-decisional dots of a trial are drawn in one batched call before the trial starts (during the ITI),
+  so no sampling happens in between window.flip() calls.
+- Post-decisional dots are pre-drawn as standard normals and only scaled/shifted once the
+  post-decisional mean is known (cheap affine transform, no sampling in the flip loop).
+- With dots_per_frame > 1 (several bees at once, see dot_field.py) every dot is an array of dots_per_frame positions.
+- Each trial gets its own numpy Generator derived from (seed, sub, block, trial), or from the seed of the trial
+  in the compiled schedule (design.py), so any single trial can be reproduced exactly without replaying the whole session.
+"""
+
+import numpy as np
+
+
+class DotSampler:
+
+    def __init__(self, sub, width, width_add, max_dots, add_dots, seed=None, dots_per_frame=1):
+        if seed is None: # draw a fresh seed, it is saved with the data so the session can be reproduced
+            seed = int(np.random.SeedSequence().entropy % 2**32)
+        self.seed       = seed
+        self.sub        = sub
+        self.width      = width
+        self.width_add  = width_add
+        self.max_dots   = max_dots
+        self.add_dots   = add_dots
+        # shape of one dot: (x,y) for a single bee, (dots_per_frame, 2) for several bees at once
+        self.dot_shape  = (2,) if dots_per_frame == 1 else (dots_per_frame, 2)
+
+        # scale of the post-decisional distribution (x: width_add, y: width), see add_dots loop in main script
+        self.post_scale = np.array([width_add, width], dtype=np.float64)
+
+        self.pre_dots   = None
+        self.post_noise = None
+
+
+    def trial_rng(self, block, trial):
+        # independent stream for every trial (same block/trial always gives the same dots)
+        return np.random.default_rng(np.random.SeedSequence(self.seed, spawn_key=(self.sub, block, trial)))
+
+
+    def prepare_trial(self, mean, block, trial, seed=None):
+        # Dot locations are sampled from a bivariate normal distribution with 0 covariance,
+        # so this is equivalent to multivariate_normal(mean, [[width**2, 0],[0, width**2]]) for each dot
+        rng             = self.trial_rng(block, trial) if seed is None else np.random.default_rng(seed)
+        self.pre_dots   = rng.standard_normal((self.max_dots,) + self.dot_shape) * self.width + np.asarray(mean, dtype=np.float64)
+        self.post_noise = rng.standard_normal((self.add_dots,) + self.dot_shape)
+        return self.pre_dots
+
+
+    def post_dots(self, mean_add_dots):
+        # equivalent to multivariate_normal([mean_add_dots,0],[[width_add**2, 0],[0, width**2]]) for each additional dot
+        post        = self.post_noise * self.post_scale
+        post[..., 0] += mean_add_dots
+        return post
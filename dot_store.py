@@ -0,0 +1,161 @@
+"""
+Binary storage for dot coordinates of the Beehives Paradigm
+
+- Instead of writing the dot coordinates as stringified tuple lists in the csv file,
+  all dots of a subject go into one flat float32 file (x, y per dot): <file_name>_dots.f32
+- An index file holds one int64 row per trial (start, n_pre, n_post): <file_name>_dots_index.i64
+  so trial i has pre-decisional dots coords[start:start+n_pre] and post-decisional dots right after.
+- The csv file only keeps the trial index (dots_index) into the store.
+- With several bees per dot (dots_per_frame in the csv file, dot_field.py) the bees of one dot are consecutive rows,
+  so n_pre and n_post count bees (dots x dots_per_frame).
+- The real duration of every dot on screen (frame_timing.py) is stored the same way, one float32 value (ms) per dot:
+  <file_name>_dot_durations.f32 with index <file_name>_dot_durations_index.i64 (start, n_pre, n_post), same trial index.
+  The csv file only has their mean and maximum.
+- All files are append-only raw arrays, so they can be memory-mapped by the analysis without parsing text
+  (and a crash leaves every trial that was synced readable).
+- add_trial() runs on the main thread, flush()/sync() on the trial writer thread (sync_also): both take a lock, and
+  flush() writes the coordinates and durations before the index files, so an index row is never written before its dots.
+"""
+
+import atexit
+import os
+import threading
+import numpy as np
+
+
+COORD_DTYPE     = np.float32
+DURATION_DTYPE  = np.float32
+INDEX_DTYPE     = np.int64
+
+
+def store_files(file_name):
+    return file_name + '_dots.f32', file_name + '_dots_index.i64'
+
+
+def duration_files(file_name):
+    return file_name + '_dot_durations.f32', file_name + '_dot_durations_index.i64'
+
+
+class DotStore:
+
+    def __init__(self, file_name, append=False):
+        coords_name, index_name = store_files(file_name)
+        durations_name, durations_index_name = duration_files(file_name)
+        mode                = 'ab' if append else 'wb'
+        self.coords_file    = open(coords_name, mode)
+        self.index_file     = open(index_name, mode)
+        self.durations_file = open(durations_name, mode)
+        self.durations_index_file = open(durations_index_name, mode)
+        # continue numbering after the trials that are already in the store (resumed session)
+        self.n_trials       = self.index_file.tell() // (3 * INDEX_DTYPE().itemsize)
+        self.n_dots         = self.coords_file.tell() // (2 * COORD_DTYPE().itemsize)
+        self.n_durations    = self.durations_file.tell() // DURATION_DTYPE().itemsize
+        self.lock           = threading.Lock()
+        atexit.register(self.close)
+
+
+    def add_trial(self, pre_dots, post_dots, pre_durations=(), post_durations=()):
+        # returns the trial index that is saved in the csv file (durations: ms of every dot, FrameTimer.dot_durations)
+        pre         = np.asarray(pre_dots, dtype=COORD_DTYPE).reshape(-1, 2)
+        post        = np.asarray(post_dots, dtype=COORD_DTYPE).reshape(-1, 2)
+        pre_ms      = np.asarray(pre_durations, dtype=DURATION_DTYPE)
+        post_ms     = np.asarray(post_durations, dtype=DURATION_DTYPE)
+
+        with self.lock:
+            self.coords_file.write(pre.tobytes())
+            self.coords_file.write(post.tobytes())
+            self.index_file.write(np.array([self.n_dots, len(pre), len(post)], dtype=INDEX_DTYPE).tobytes())
+            self.durations_file.write(pre_ms.tobytes())
+            self.durations_file.write(post_ms.tobytes())
+            self.durations_index_file.write(np.array([self.n_durations, len(pre_ms), len(post_ms)], dtype=INDEX_DTYPE).tobytes())
+
+            trial_index         = self.n_trials
+            self.n_dots        += len(pre) + len(post)
+            self.n_durations   += len(pre_ms) + len(post_ms)
+            self.n_trials      += 1
+        return trial_index
+
+
+    def flush(self):
+        # dots before the index, no trial is added in between (lock)
+        with self.lock:
+            if self.coords_file.closed:
+                return
+            for f in (self.coords_file, self.durations_file, self.index_file, self.durations_index_file):
+                f.flush()
+
+
+    def sync(self):
+        self.flush()
+        with self.lock:
+            if self.coords_file.closed:
+                return
+            for f in (self.coords_file, self.durations_file, self.index_file, self.durations_index_file):
+                os.fsync(f.fileno())
+
+
+    def close(self):
+        if not self.coords_file.closed:
+            self.sync()
+            for f in (self.coords_file, self.index_file, self.durations_file, self.durations_index_file):
+                f.close()
+
+
+
+class DotStoreReader:
+
+    def __init__(self, file_name):
+        coords_name, index_name = store_files(file_name)
+        self.index  = np.fromfile(index_name, dtype=INDEX_DTYPE).reshape(-1, 3)
+        if os.path.getsize(coords_name) > 0:
+            self.coords = np.memmap(coords_name, dtype=COORD_DTYPE, mode='r').reshape(-1, 2)
+        else:
+            self.coords = np.zeros((0, 2), dtype=COORD_DTYPE)
+
+        # dot durations (None: data file from before they were stored)
+        durations_name, durations_index_name = duration_files(file_name)
+        self.durations          = None
+        if os.path.isfile(durations_index_name):
+            self.durations_index    = np.fromfile(durations_index_name, dtype=INDEX_DTYPE).reshape(-1, 3)
+            self.durations          = np.fromfile(durations_name, dtype=DURATION_DTYPE)
+
+
+    def __len__(self):
+        return len(self.index)
+
+
+    def pre(self, trial_index):
+        start, n_pre, n_post = self.index[trial_index]
+        return self.coords[start:start + n_pre]
+
+
+    def post(self, trial_index):
+        start, n_pre, n_post = self.index[trial_index]
+        return self.coords[start + n_pre:start + n_pre + n_post]
+
+
+    def pre_durations(self, trial_index):
+        # ms each pre-decisional dot was on screen (empty: not stored)
+        if self.durations is None:
+            return np.zeros(0, dtype=DURATION_DTYPE)
+        start, n_pre, n_post = self.durations_index[trial_index]
+        return self.durations[start:start + n_pre]
+
+
+    def post_durations(self, trial_index):
+        if self.durations is None:
+            return np.zeros(0, dtype=DURATION_DTYPE)
+        start, n_pre, n_post = self.durations_index[trial_index]
+        return self.durations[start + n_pre:start + n_pre + n_post]
+
+
+    def means(self):
+        # mean x coordinate of the pre- and post-decisional dots of every trial (nan if there are no dots)
+        x       = np.concatenate([[0.0], np.cumsum(self.coords[:, 0], dtype=np.float64)])
+        start   = self.index[:, 0]
+        n_pre   = self.index[:, 1]
+        n_post  = self.index[:, 2]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            pre_mean    = (x[start + n_pre] - x[start]) / n_pre
+            post_mean   = (x[start + n_pre + n_post] - x[start + n_pre]) / n_post
+        return pre_mean, post_mean
@@ -0,0 +1,36 @@
+"""
+Incremental evidence accumulator for the Beehives Paradigm
+
+- Updated once per dot with the x coordinate of the bee, so all statistics cost constant time per dot
+  (no recomputation over all dots of the trial when the response comes in).
+- Keeps the running mean and variance (Welford) and the cumulative log-likelihood ratio of
+  right vs. left under the generative model: x ~ N(+difficulty, width) for right, N(-difficulty, width) for left
+  -> log N(x; d, w) - log N(x; -d, w) = 2*d*x / w**2 for every dot.
+"""
+
+class EvidenceAccumulator:
+
+    def __init__(self, width):
+        self.width = width
+        self.reset(0)
+
+
+    def reset(self, difficulty):
+        self.llr_gain   = 2 * difficulty / self.width**2
+        self.n          = 0
+        self.mean       = 0.0
+        self.m2         = 0.0
+        self.llr        = 0.0
+
+
+    def add(self, x):
+        self.n     += 1
+        delta       = x - self.mean
+        self.mean  += delta / self.n
+        self.m2    += delta * (x - self.mean)
+        self.llr   += self.llr_gain * x
+
+
+    @property
+    def variance(self):
+        return self.m2 / (self.n - 1) if self.n > 1 else 0.0
@@ -0,0 +1,120 @@
+"""
+Frame timing instrumentation for the Beehives Paradigm
+
+- Every window.flip() within a trial goes through FrameTimer.flip(), which stores the flip timestamp,
+  the trial phase and the dot number in preallocated numpy buffers (nothing is allocated per flip).
+- At the end of a trial the buffers are summarised: longest frame interval, number of dropped/late frames
+  (overall and per phase) and mean/maximum of the real presentation durations of the pre- and post-decisional dots.
+  The duration of every dot (dot_durations()) goes into the binary dot store (dot_store.py), not into the csv file.
+- Intervals that include waiting for a key press (e.g. confidence screen) are excluded with gap().
+- The buffers hold capacity flips per trial (experiment script: timeline.max_flips(), the longest possible trial
+  at the measured refresh rate). Flips beyond it are counted in n_flips but not timed, and summary() warns.
+"""
+
+import warnings
+import numpy as np
+from time import perf_counter
+
+
+# Trial phases (index in this tuple is the phase code stored in the buffer)
+PHASES      = ('fixation', 'beehives', 'pre_dot', 'post_dot', 'blank', 'feedback', 'confidence', 'timeout', 'iti')
+
+FIXATION, BEEHIVES, PRE_DOT, POST_DOT, BLANK, FEEDBACK, CONFIDENCE, TIMEOUT, ITI = range(len(PHASES))
+
+
+class FrameTimer:
+
+    def __init__(self, window, frame_ms, capacity=2048, late_factor=1.5):
+        self.window     = window
+        self.frame_s    = frame_ms / 1000
+        self.late_s     = self.frame_s * late_factor # an interval longer than this counts as a dropped frame
+        self.capacity   = capacity
+
+        self.times      = np.zeros(capacity, dtype=np.float64)
+        self.phase      = np.zeros(capacity, dtype=np.int8)
+        self.dot        = np.zeros(capacity, dtype=np.int16)
+        self.contiguous = np.zeros(capacity, dtype=np.bool_) # False: interval to previous flip is not a frame (gap/first flip)
+
+        self.n          = 0
+        self.overflow   = 0 # flips of this trial that did not fit in the buffers
+        self._gap       = True
+
+
+    def start_trial(self):
+        self.n          = 0
+        self.overflow   = 0
+        self._gap       = True
+
+
+    def gap(self):
+        # call after waiting for a key press: the next interval is not a frame interval
+        self._gap = True
+
+
+    def flip(self, phase, dot=0):
+        t = self.window.flip()
+        if t is None: # flip time is not returned when waitBlanking is off
+            t = perf_counter()
+
+        n = self.n
+        if n < self.capacity:
+            self.times[n]       = t
+            self.phase[n]       = phase
+            self.dot[n]         = dot
+            self.contiguous[n]  = not self._gap
+            self.n              = n + 1
+        else:
+            self.overflow      += 1
+        self._gap = False
+        return t
+
+
+    def summary(self):
+        # per-trial summary that is added to the data file (durations in ms)
+        n           = self.n
+        times       = self.times[:n]
+        phase       = self.phase[:n]
+
+        intervals   = np.diff(times)
+        valid       = self.contiguous[1:n]
+        late        = valid & (intervals > self.late_s)
+
+        # an interval is attributed to the phase of the flip that ends it
+        drops_phase = np.bincount(phase[1:][late], minlength=len(PHASES))
+
+        if self.overflow:
+            warnings.warn('%d flips of this trial were not timed (capacity %d flips), frame timing columns only cover the first %d'
+                          % (self.overflow, self.capacity, self.capacity))
+
+        summary = {
+            'frame_max_interval':   round(float(intervals[valid].max()) * 1000, 3) if valid.any() else -99,
+            'frame_drops':          int(late.sum()),
+            'n_flips':              n + self.overflow,
+        }
+        for code, name in enumerate(PHASES):
+            summary['frame_drops_' + name] = int(drops_phase[code])
+
+        for name, dot_phase in (('pre_dots', PRE_DOT), ('post_dots', POST_DOT)):
+            durations                           = self.dot_durations(dot_phase)
+            summary[name + '_duration_mean']    = round(float(durations.mean()), 2) if len(durations) else -99
+            summary[name + '_duration_max']     = round(float(durations.max()), 2) if len(durations) else -99
+        return summary
+
+
+    def dot_durations(self, dot_phase):
+        # real duration of each dot (ms): onset of the dot until onset of whatever is shown next
+        n       = self.n
+        times   = self.times[:n]
+        phase   = self.phase[:n]
+        dot     = self.dot[:n]
+
+        if n < 2:
+            return np.zeros(0)
+
+        change  = np.ones(n, dtype=np.bool_)
+        change[1:] = (phase[1:] != phase[:-1]) | (dot[1:] != dot[:-1])
+        onsets  = np.flatnonzero(change)
+        ends    = np.append(onsets[1:], n - 1)
+
+        is_dot  = (phase[onsets] == dot_phase) & (ends > onsets)
+        return (times[ends[is_dot]] - times[onsets[is_dot]]) * 1000
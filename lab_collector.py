@@ -0,0 +1,301 @@
+"""
+Collecting the data of all stations in the lab while the Beehives Paradigm runs
+
+Station side (NetworkSink, used by the experiment script when collector_address is set):
+- completed trials are put on a queue (never waits), a background thread sends them in batches
+  over one persistent TCP connection as json lines and waits for the collector's acknowledgement
+- when the collector cannot be reached the trials are spooled to a local file and sent after reconnecting
+  (also after a restart of the script), the local csv file stays the primary copy anyway
+- while the spool file has trials that were not acknowledged, new trials are appended to it and it is sent in order,
+  batch_size trials at a time (only one batch is in memory, serialized once and sent again as is after a failure)
+- closed at exit (atexit), also when the session is stopped with escape
+
+Collector side (python lab_collector.py):
+- receives the trials of all stations and appends them to one json lines store (duplicates are skipped)
+- prints the progress of every station (subject, block, trials, accuracy) every few seconds
+
+Usage: python lab_collector.py [--host 0.0.0.0] [--port 5005] [--store Data/lab_collected.jsonl]
+Test on one PC: run the collector with --host 127.0.0.1 and set collector_address = ('127.0.0.1', 5005) in the script.
+"""
+
+import argparse
+import atexit
+import json
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+import uuid
+
+
+def to_json(value):
+    # numpy values and arrays in the trial data
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    return str(value)
+
+
+
+################
+# Station side #
+################
+
+class NetworkSink:
+
+    def __init__(self, address, station, spool_file, extra_info=None, batch_size=20, flush_interval=0.5, timeout=2.0):
+        self.address        = tuple(address)
+        self.station        = station
+        self.spool_file     = spool_file
+        self.extra_info     = dict(extra_info or {}) # added to every trial (subject number, ...)
+        self.batch_size     = batch_size
+        self.flush_interval = flush_interval
+        self.timeout        = timeout
+
+        self.queue          = queue.Queue()
+        self.connection     = None
+        self.retry_at       = 0.0
+        self.retry_delay    = 1.0
+        self.session        = uuid.uuid4().hex  # trials are numbered per session (a resumed session starts a new one)
+        self.seq            = 0
+        self.window         = None  # next batch of the spool file: (message, last record, end offset)
+        self.spool_offset   = 0     # bytes of the spool file that were acknowledged
+        self.backlog        = self._repair_spool()  # trials of an earlier run that were never acknowledged
+        self.closed         = False
+
+        self.thread         = threading.Thread(target=self._run, name='NetworkSink', daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+
+    def put(self, row):
+        # called from the render thread: only puts the trial on the queue
+        self.queue.put_nowait(dict(row))
+
+
+    def close(self, timeout=5.0):
+        # last attempt to send everything, whatever is left stays in the spool file
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(None)
+        self.thread.join(timeout)
+
+
+    def _run(self):
+        stop = False
+        while not stop:
+            batch = []
+            try:
+                item = self.queue.get(timeout=self.flush_interval)
+                while True:
+                    if item is None:
+                        stop = True
+                        break
+                    item.update(self.extra_info)
+                    batch.append({'session': self.session, 'seq': self.seq, 'row': item})
+                    self.seq += 1
+                    if len(batch) >= self.batch_size:
+                        break
+                    item = self.queue.get_nowait()
+            except queue.Empty:
+                pass
+
+            if batch and (self.backlog or not self._send(self._message(batch), batch[-1])):
+                self._spool(batch) # after the trials that are still in the spool file, or collector not reachable
+            while self.backlog and self._send_spooled():
+                pass
+
+        if self.connection:
+            self.connection.close()
+
+
+    def _message(self, records):
+        return (json.dumps({'station': self.station, 'records': records}, default=to_json) + '\n').encode()
+
+
+    def _send(self, message, last):
+        if self.connection is None:
+            if time.monotonic() < self.retry_at: # wait a bit before reconnecting
+                return False
+            try:
+                self.connection = socket.create_connection(self.address, timeout=self.timeout)
+                self.reader     = self.connection.makefile('r')
+                self.retry_delay = 1.0
+            except OSError:
+                self._disconnect()
+                return False
+        try:
+            self.connection.sendall(message)
+            ack = json.loads(self.reader.readline() or 'null')
+            if ack and ack.get('ack') == [last['session'], last['seq']]:
+                return True
+        except (OSError, ValueError):
+            pass
+        self._disconnect()
+        return False
+
+
+    def _disconnect(self):
+        if self.connection:
+            self.connection.close()
+        self.connection     = None
+        self.retry_at       = time.monotonic() + self.retry_delay
+        self.retry_delay    = min(self.retry_delay * 2, 30.0)
+
+
+    def _send_spooled(self):
+        # sends the next batch of the spool file, True when it was acknowledged
+        if self.window is None:
+            with open(self.spool_file, 'rb') as f:
+                f.seek(self.spool_offset)
+                lines = []
+                while len(lines) < self.batch_size:
+                    line = f.readline()
+                    if not line:
+                        break
+                    lines.append(line.rstrip(b'\n'))
+                end = f.tell()
+            if not lines: # everything was acknowledged
+                self._clear_spool()
+                return False
+            message     = b'{"station": ' + json.dumps(self.station).encode() + b', "records": [' + b', '.join(lines) + b']}\n'
+            self.window = (message, json.loads(lines[-1]), end)
+
+        message, last, end = self.window
+        if not self._send(message, last):
+            return False
+        self.window         = None
+        self.spool_offset   = end
+        if self.spool_offset >= os.path.getsize(self.spool_file):
+            self._clear_spool()
+        return True
+
+
+    def _spool(self, records):
+        with open(self.spool_file, 'a') as f:
+            for record in records:
+                f.write(json.dumps(record, default=to_json) + '\n')
+        self.backlog = True
+
+
+    def _repair_spool(self):
+        # drops a line that was cut off when the script stopped while spooling, True when there are trials to send
+        if not os.path.isfile(self.spool_file):
+            return False
+        with open(self.spool_file, 'rb+') as f:
+            end = f.read().rfind(b'\n') + 1
+            f.truncate(end)
+        if end == 0:
+            os.remove(self.spool_file)
+        return end > 0
+
+
+    def _clear_spool(self):
+        if os.path.isfile(self.spool_file):
+            os.remove(self.spool_file)
+        self.backlog        = False
+        self.spool_offset   = 0
+        self.window         = None
+
+
+
+##################
+# Collector side #
+##################
+
+class Collector:
+
+    def __init__(self, store_file):
+        self.store_file = store_file
+        self.lock       = threading.Lock()
+        self.last_seq   = {}   # (station, session) -> last sequence number in the store
+        self.progress   = {}   # station -> dict with progress info
+        if os.path.isfile(store_file): # continue an existing store
+            with open(store_file) as f:
+                for line in f:
+                    if line.strip():
+                        self._update(json.loads(line))
+        self.store = open(store_file, 'a', buffering=1)
+
+
+    def add(self, station, records):
+        with self.lock:
+            for record in records:
+                if record['seq'] <= self.last_seq.get((station, record['session']), -1): # sent again after a lost acknowledgement
+                    continue
+                entry = {'station': station, 'session': record['session'], 'seq': record['seq'], 'received': time.time(), 'row': record['row']}
+                self.store.write(json.dumps(entry) + '\n')
+                self._update(entry)
+            self.store.flush()
+            os.fsync(self.store.fileno())
+        return [records[-1]['session'], records[-1]['seq']] if records else None
+
+
+    def _update(self, entry):
+        station, row                = entry['station'], entry['row']
+        key                         = (station, entry['session'])
+        self.last_seq[key]          = max(entry['seq'], self.last_seq.get(key, -1))
+        p                           = self.progress.setdefault(station, {'trials': 0, 'correct': 0, 'answered': 0})
+        p['trials']                += 1
+        p['sub']                    = row.get('sub', '?')
+        p['block']                  = row.get('block', '?')
+        p['last']                   = entry['received']
+        if row.get('running') == 'main' and row.get('accuracy', -99) in (0, 1):
+            p['answered']          += 1
+            p['correct']           += row['accuracy']
+
+
+    def report(self):
+        with self.lock:
+            lines = ['%-20s %6s %6s %7s %9s %10s' % ('station', 'sub', 'block', 'trials', 'accuracy', 'last trial')]
+            for station, p in sorted(self.progress.items()):
+                accuracy = '%.1f%%' % (100 * p['correct'] / p['answered']) if p['answered'] else '-'
+                lines.append('%-20s %6s %6s %7d %9s %8.0f s' % (station, p['sub'], p['block'], p['trials'], accuracy, time.time() - p['last']))
+        return '\n'.join(lines)
+
+
+
+class StationHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile: # one batch per line, connection stays open
+            message = json.loads(line)
+            last    = self.server.collector.add(message['station'], message['records'])
+            self.wfile.write((json.dumps({'ack': last}) + '\n').encode())
+
+
+
+class CollectorServer(socketserver.ThreadingTCPServer):
+    daemon_threads      = True
+    allow_reuse_address = True
+
+    def __init__(self, address, collector):
+        super().__init__(address, StationHandler)
+        self.collector = collector
+
+
+
+def run_collector(host, port, store_file, report_every=5.0):
+    collector   = Collector(store_file)
+    server      = CollectorServer((host, port), collector)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print('Collecting on %s:%d into %s (Ctrl+C to stop)' % (host, port, store_file))
+    try:
+        while True:
+            time.sleep(report_every)
+            print('\n' + collector.report())
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Collect the trials of all stations in one store')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5005)
+    parser.add_argument('--store', default=os.path.join('Data', 'lab_collected.jsonl'))
+    args = parser.parse_args()
+    os.makedirs(os.path.dirname(args.store) or '.', exist_ok=True)
+    run_collector(args.host, args.port, args.store)
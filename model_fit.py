@@ -0,0 +1,339 @@
+"""
+Model fitting for the Beehives Paradigm: sequential sampling with post-decisional evidence accumulation
+
+Model (per trial, using the dots that were actually shown):
+- every dot adds gain * x/width + N(0,1) to an accumulator that starts at 0
+- the choice is made when the accumulator reaches +bound (right) or -bound (left),
+  the key press comes latency_dots dots later, during dot n_pre = crossing + latency_dots (the keyboard is checked
+  every frame, so that dot is shown until the key press and is the last pre-decisional dot in the data)
+- with probability lapse the response is a guess at a random dot
+- timed-out trials (no key press within max_dots dots) are censored: their likelihood is the probability that the
+  bound was not crossed in time for a key press (up to dot max_dots - latency_dots), times 1 - lapse
+- confidence: evidence of all dots after the crossing (the latency dots and the post-decisional dots),
+  weighted by post_weight, in the direction of the choice, cut into 6 levels by 5 ordered criteria
+  (RTconf is not modelled)
+
+Fitting:
+- the choice/RT likelihood of all trials of a subject is computed at once: the accumulator density is propagated
+  on a grid for every trial in parallel (FFT convolution, one row per trial, a trial drops out after its response dot,
+  a timed-out trial after its last dot), the confidence likelihood is closed-form
+- subjects are fitted in parallel in a process pool
+- estimates are cached per subject (Data/fits/fit_cache.json): unchanged data is not refitted,
+  changed data (e.g. more trials) starts from the previous estimate
+- subjects without main block trials with a response (e.g. a session stopped during practice), without
+  dot store (older data files) or with several bees per dot (dots_per_frame > 1) are skipped with a message
+- dot store index and bees per dot come from the trials read by analysis.ingest_subject (the csv file is read once)
+
+Usage: python model_fit.py [--data Data] [--workers 4]
+       python model_fit.py --benchmark 8   (fit time per subject on simulated subjects)
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+
+import numpy as np
+from scipy import optimize, special
+
+from analysis import ingest_subject
+from design import default_config, session_config
+from dot_store import DotStoreReader, store_files
+
+
+latency_dots    = 2     # dots from bound crossing to the dot during which the key is pressed (not fitted)
+n_grid          = 63    # grid points of the accumulator (odd, so 0 is on the grid)
+
+parameter_names = ['gain', 'bound', 'lapse', 'post_weight', 'c1', 'c2', 'c3', 'c4', 'c5']
+start_params    = np.array([1.0, 3.0, 0.02, 1.0, -2.0, -1.0, 0.0, 1.0, 2.0])
+
+
+
+#####################
+# Data of a subject #
+#####################
+
+class SubjectDataError(ValueError):
+    pass
+
+
+def load_subject(csv_file):
+    # trial-wise evidence as arrays (trials of the main blocks, timed-out trials included)
+    base    = os.path.splitext(csv_file)[0]
+    if not all(os.path.isfile(f) for f in store_files(base)):
+        raise SubjectDataError('no dot store (%s), data files from before the dot store cannot be fitted' % store_files(base)[0])
+    trials  = ingest_subject(csv_file)
+    if len(trials) and trials['dots_per_frame'].max() > 1: # several bees per dot (dot_field.py)
+        raise SubjectDataError('%d bees per dot, the model has one bee per dot' % trials['dots_per_frame'].max())
+    dots    = DotStoreReader(base)
+
+    keep    = trials['main'] & (trials['n_pre_dots'] > 0)
+    pre     = [dots.pre(i)[:, 0] for i in trials['dots_index'][keep]]
+    post    = [dots.post(i)[:, 0] for i in trials['dots_index'][keep]]
+    return make_data(pre, post, trials['response_right'][keep], trials['cj'][keep], session_config(base))
+
+
+def make_data(pre, post, response_right, cj, config=default_config):
+    # pre/post: lists with the x coordinates of the dots of each trial, response_right -99: timed-out
+    # config: design of the session (x / width is the evidence of a dot, max_dots dots until a time-out)
+    width       = config['width']
+    n_trials    = len(pre)
+    censored    = np.asarray(response_right) < 0
+    if n_trials == 0 or censored.all(): # e.g. session stopped during the practice block
+        raise SubjectDataError('no main block trials with a response')
+    max_pre     = max(len(p) for p in pre)
+    max_post    = max(max((len(p) for p in post), default=0), 1)
+
+    pre_x       = np.zeros((n_trials, max_pre))
+    post_x      = np.zeros((n_trials, max_post + latency_dots))
+    n_after     = np.zeros(n_trials, dtype=np.int64)
+    for t in range(n_trials):
+        pre_x[t, :len(pre[t])] = pre[t]
+        # dots after the crossing: the last latency_dots pre-decisional dots and the post-decisional dots
+        after                   = np.concatenate([pre[t][-latency_dots:] if latency_dots else [], post[t]])
+        post_x[t, :len(after)]  = after
+        n_after[t]              = len(after)
+
+    n_pre = np.array([len(p) for p in pre])
+    return {
+        'pre_x':        pre_x / width,
+        'cross_dot':    n_pre - latency_dots,   # dot (1-based) at which the bound was crossed (<1: only possible as lapse),
+                                                # timed-out: last dot at which it could have been crossed
+        'censored':     censored,
+        'choice':       np.maximum(np.asarray(response_right, dtype=np.int64), 0),
+        'after_sum':    post_x.sum(axis=1) / width,
+        'n_after':      n_after,
+        'cj':           np.asarray(cj, dtype=np.int64),
+        'max_dots':     max(config['max_dots'], max_pre),
+    }
+
+
+
+##############
+# Likelihood #
+##############
+
+def unpack(theta):
+    # unconstrained -> model parameters
+    gain        = np.exp(theta[0])
+    bound       = np.exp(theta[1])
+    lapse       = special.expit(theta[2])
+    post_weight = np.exp(theta[3])
+    criteria    = theta[4] + np.concatenate([[0], np.cumsum(np.exp(theta[5:9]))])
+    return gain, bound, lapse, post_weight, criteria
+
+
+def pack(params):
+    gain, bound, lapse, post_weight = params[:4]
+    criteria = np.asarray(params[4:9])
+    return np.concatenate([[np.log(gain), np.log(bound), special.logit(lapse), np.log(post_weight), criteria[0]],
+                           np.log(np.maximum(np.diff(criteria), 1e-6))])
+
+
+def crossing_probabilities(drift, bound, cross_dot, censored=None):
+    # drift: (trials, dots) mean increment of every dot of every trial (noise sd is 1)
+    # cross_dot: dot (1-based) at which each trial crossed a bound
+    # returns (trials, 2): probability of crossing -bound (0) / +bound (1) exactly at that dot (0 if cross_dot < 1)
+    # censored trials (timed-out): probability of no crossing up to and including cross_dot, in both columns
+    # Trials are propagated in order of their crossing dot, so every step only uses the trials that still need it.
+    n_trials    = drift.shape[0]
+    censored    = np.zeros(n_trials, dtype=bool) if censored is None else censored
+    dg          = 2 * bound / n_grid
+    grid        = -bound + (np.arange(n_grid) + 0.5) * dg
+    offsets     = (np.arange(2 * n_grid - 1) - (n_grid - 1)) * dg # possible grid-to-grid distances
+    n_fft       = 1 << int(np.ceil(np.log2(3 * n_grid - 2)))
+
+    needed      = np.where(censored, cross_dot + 1, cross_dot) # censored: density after cross_dot dots
+    order       = np.argsort(-needed, kind='stable')
+    needed      = needed[order]
+    censored    = censored[order]
+    n_steps     = max(int(needed[0]), 0) if n_trials else 0
+    drift       = np.pad(drift[order], ((0, 0), (0, max(n_steps - drift.shape[1], 0)))) # step of a censored trial after its last dot
+
+    density     = np.zeros((n_trials, n_grid))
+    density[:, n_grid // 2] = 1.0
+    crossings   = np.zeros((n_trials, 2))
+
+    for step in range(n_steps):
+        active                  = np.count_nonzero(needed > step) # needed is sorted, so these are the first rows
+        dens                    = density[:active]
+        mu                      = drift[:active, step][:, None]
+
+        # trials that cross at this dot: probability of leaving the grid through either bound
+        done                    = slice(np.count_nonzero(needed > step + 1), active)
+        crossings[done, 1]      = np.einsum('tg,tg->t', dens[done], special.ndtr(grid[None, :] + mu[done] - bound))
+        crossings[done, 0]      = np.einsum('tg,tg->t', dens[done], special.ndtr(-bound - grid[None, :] - mu[done]))
+        survived                = done.start + np.flatnonzero(censored[done])
+        crossings[survived]     = density[survived].sum(axis=1)[:, None]
+
+        # density that stays in between the bounds: convolution with N(mu, 1), one kernel per trial
+        kernel                  = np.exp(-0.5 * (offsets[None, :] - mu)**2) * dg / np.sqrt(2 * np.pi)
+        full                    = np.fft.irfft(np.fft.rfft(dens, n_fft) * np.fft.rfft(kernel, n_fft), n_fft)
+        density[:active]        = np.maximum(full[:, n_grid - 1:2 * n_grid - 1], 0)
+
+    result          = np.zeros((n_trials, 2))
+    result[order]   = crossings
+    return result
+
+
+def negative_log_likelihood(theta, data):
+    gain, bound, lapse, post_weight, criteria = unpack(theta)
+
+    # choice and time of the response
+    # timed-out trials: no crossing in time and no lapse (a lapse is a response at a random dot)
+    crossings   = crossing_probabilities(gain * data['pre_x'], bound, data['cross_dot'], data['censored'])
+    p_model     = crossings[np.arange(len(crossings)), data['choice']]
+    p_choice    = (1 - lapse) * p_model + np.where(data['censored'], 0, lapse * 0.5 / data['max_dots'])
+    nll         = -np.sum(np.log(np.maximum(p_choice, 1e-300)))
+
+    # confidence (only trials with a rating)
+    rated       = data['cj'] > 0
+    if rated.any():
+        direction   = np.where(data['choice'][rated] == 1, 1.0, -1.0)
+        mean        = direction * gain * post_weight * data['after_sum'][rated]
+        sd          = np.sqrt(np.maximum(data['n_after'][rated], 1))
+        edges       = np.concatenate([[-np.inf], criteria, [np.inf]])
+        cj          = data['cj'][rated]
+        p_cj        = special.ndtr((edges[cj] - mean) / sd) - special.ndtr((edges[cj - 1] - mean) / sd)
+        nll        -= np.sum(np.log(np.maximum(p_cj, 1e-300)))
+
+    return nll
+
+
+def fit(data, theta0=None):
+    theta0  = pack(start_params) if theta0 is None else np.asarray(theta0)
+    result  = optimize.minimize(negative_log_likelihood, theta0, args=(data,), method='L-BFGS-B')
+    return result.x, result.fun
+
+
+
+################################
+# Many subjects, warm starting #
+################################
+
+def data_hash(data):
+    h = hashlib.sha1()
+    for name in sorted(data):
+        h.update(np.ascontiguousarray(data[name]).tobytes())
+    return h.hexdigest()
+
+
+def _fit_job(job):
+    name, data, theta0 = job
+    start           = perf_counter()
+    theta, nll      = fit(data, theta0)
+    return name, theta.tolist(), float(nll), perf_counter() - start
+
+
+def fit_subjects(datasets, cache_file=None, workers=None):
+    # datasets: {name: data}, returns {name: {parameter: estimate, 'nll': ..}}
+    cache = {}
+    if cache_file and os.path.isfile(cache_file):
+        with open(cache_file) as f:
+            cache = json.load(f)
+
+    jobs, results = [], {}
+    for name, data in datasets.items():
+        entry   = cache.get(name)
+        digest  = data_hash(data)
+        if entry and entry['hash'] == digest: # same data: nothing to do
+            results[name] = entry
+        else:                                 # new subject or changed data: start from previous estimate if there is one
+            jobs.append((name, data, entry['theta'] if entry else None))
+            cache[name] = {'hash': digest}
+
+    if jobs:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for name, theta, nll, seconds in pool.map(_fit_job, jobs):
+                cache[name].update({'theta': theta, 'nll': nll, 'seconds': seconds})
+                results[name] = cache[name]
+
+    if cache_file:
+        os.makedirs(os.path.dirname(cache_file) or '.', exist_ok=True)
+        temp_file = cache_file + '.tmp'
+        with open(temp_file, 'w') as f:
+            json.dump(cache, f, indent=1)
+        os.replace(temp_file, cache_file)
+
+    for entry in results.values():
+        gain, bound, lapse, post_weight, criteria = unpack(np.array(entry['theta']))
+        entry.update(dict(zip(parameter_names, [gain, bound, lapse, post_weight] + criteria.tolist())))
+    return results
+
+
+
+#############
+# Benchmark #
+#############
+
+def simulate_subject(params, n_trials, rng, config=default_config):
+    # data from the model itself (for the benchmark and parameter recovery), design of config
+    width, width_add, max_dots, add_dots, dif_lvl = (config[key] for key in ('width', 'width_add', 'max_dots', 'add_dots', 'dif_lvl'))
+    gain, bound, lapse, post_weight = params[:4]
+    criteria    = np.asarray(params[4:9])
+    pre, post, choice, cj = [], [], [], []
+    while len(pre) < n_trials:
+        mean        = rng.choice(dif_lvl) * rng.choice([-1, 1])
+        x           = rng.normal(mean, width, max_dots + latency_dots)
+        evidence    = np.cumsum(gain * x / width + rng.standard_normal(len(x)))
+        crossed     = np.flatnonzero(np.abs(evidence) >= bound)
+        if rng.random() < lapse:
+            n_pre, right = rng.integers(1, max_dots + 1), rng.random() < 0.5
+        elif len(crossed) and crossed[0] + 1 + latency_dots <= max_dots:
+            n_pre, right = crossed[0] + 1 + latency_dots, evidence[crossed[0]] > 0
+        else: # timed-out: all dots, no post-decisional dots and no confidence
+            pre.append(x[:max_dots]); post.append(np.zeros(0)); choice.append(-99); cj.append(-99)
+            continue
+        post_x      = rng.normal(mean, width_add, add_dots)
+        after       = np.concatenate([x[n_pre - latency_dots:n_pre], post_x])
+        direction   = 1 if right else -1
+        v           = direction * np.sum(gain * post_weight * after / width + rng.standard_normal(len(after)))
+        pre.append(x[:n_pre]); post.append(post_x); choice.append(int(right)); cj.append(np.searchsorted(criteria, v) + 1)
+    return make_data(pre, post, choice, cj, config)
+
+
+def benchmark(n_subjects, n_trials=448, workers=None, seed=0):
+    rng         = np.random.default_rng(seed)
+    datasets    = {'sim%d' % s: simulate_subject(start_params, n_trials, rng) for s in range(n_subjects)}
+
+    data        = next(iter(datasets.values()))
+    theta       = pack(start_params)
+    start       = perf_counter()
+    for i in range(20):
+        negative_log_likelihood(theta, data)
+    print('Likelihood of %d trials: %.1f ms' % (n_trials, (perf_counter() - start) / 20 * 1000))
+
+    start       = perf_counter()
+    results     = fit_subjects(datasets, workers=workers)
+    total       = perf_counter() - start
+    seconds     = [r['seconds'] for r in results.values()]
+    print('%d subjects fitted in %.1f s (%.1f s per subject, wall time %.1f s per subject)'
+          % (n_subjects, total, np.mean(seconds), total / n_subjects))
+    for name in parameter_names[:4]:
+        print('  %-12s true %.3f   recovered %.3f' % (name, start_params[parameter_names.index(name)], np.mean([r[name] for r in results.values()])))
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fit the sequential sampling model to every subject')
+    parser.add_argument('--data', default='Data', help='folder with the DotsTask_subN.csv files and dot stores')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes (default: number of cores)')
+    parser.add_argument('--benchmark', type=int, default=0, metavar='N', help='fit N simulated subjects and report the fit time')
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.benchmark, workers=args.workers)
+    else:
+        datasets = {}
+        for csv_file in sorted(glob.glob(os.path.join(args.data, 'DotsTask_sub*.csv'))):
+            try:
+                datasets[os.path.basename(csv_file)] = load_subject(csv_file)
+            except SubjectDataError as error: # the other subjects are still fitted
+                print('%s skipped: %s' % (os.path.basename(csv_file), error))
+        results  = fit_subjects(datasets, os.path.join(args.data, 'fits', 'fit_cache.json'), args.workers)
+        print('subject              ' + ' '.join('%8s' % name for name in parameter_names) + '       nll')
+        for name, r in results.items():
+            print('%-20s ' % name + ' '.join('%8.3f' % r[p] for p in parameter_names) + ' %9.1f' % r['nll'])
@@ -0,0 +1,175 @@
+"""
+Phase-level profiling of the Beehives Paradigm
+
+- Code is marked with profiler.phase('name') (context manager), @profiler.function() (decorator)
+  or profiler.begin('name') / profiler.end() for long stretches (e.g. a whole trial).
+- Every phase that ends is stored in a preallocated ring buffer (start, end, stack, trial): no allocation,
+  no I/O during the session. When the buffer is full the oldest phases are overwritten.
+- Disabled (default), phase() returns one shared null context and function() returns the function itself,
+  so the hooks can stay in the experiment script (well below 1 us per hook, see python profiling.py).
+- export() writes <file_name>_trace.json (Chrome trace / Perfetto: chrome://tracing or ui.perfetto.dev)
+  and <file_name>_folded.txt (folded stacks with self time in us, for flamegraph.pl or speedscope).
+
+Usage: python profiling.py  (cost of a disabled and an enabled hook)
+"""
+
+import contextlib
+import functools
+import json
+from time import perf_counter
+
+import numpy as np
+
+
+class _Phase:
+    # one object per phase name (reused, nothing is allocated when a phase starts)
+
+    def __init__(self, profiler, name):
+        self.profiler   = profiler
+        self.name       = name
+
+    def __enter__(self):
+        self.profiler.begin(self.name)
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.end()
+        return False
+
+
+
+class Profiler:
+
+    def __init__(self, enabled=False, capacity=2**18):
+        self.enabled    = enabled
+        self.capacity   = capacity
+        self.n          = 0     # number of phases recorded (also the ones that were overwritten)
+        self.trial      = -1
+        self.origin     = perf_counter()
+
+        self.phases     = {}    # name -> _Phase
+        self.stacks     = {}    # stack (tuple of names) -> code
+        self.stack      = []    # names of the phases that are running
+        self.starts     = []    # their start times
+
+        if enabled:
+            self.start_time = np.zeros(capacity, dtype=np.float64)
+            self.end_time   = np.zeros(capacity, dtype=np.float64)
+            self.stack_code = np.zeros(capacity, dtype=np.int32)
+            self.trial_nr   = np.zeros(capacity, dtype=np.int32)
+        else:
+            self.phase      = self._null_phase
+            self.begin      = self._nothing
+            self.end        = self._nothing
+            self.set_trial  = self._nothing
+
+
+    _null = contextlib.nullcontext()
+
+    def _null_phase(self, name):
+        return self._null
+
+    def _nothing(self, *args):
+        pass
+
+
+    def phase(self, name):
+        phase = self.phases.get(name)
+        if phase is None:
+            phase = self.phases[name] = _Phase(self, name)
+        return phase
+
+
+    def function(self, name=None):
+        # decorator: the whole function is one phase (disabled: the function is not wrapped at all)
+        def decorate(function):
+            if not self.enabled:
+                return function
+            phase = self.phase(name or function.__name__)
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with phase:
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorate
+
+
+    def set_trial(self, trial):
+        # trial number stored with the phases (e.g. row number in the data file)
+        self.trial = trial
+
+
+    def begin(self, name):
+        self.stack.append(name)
+        self.starts.append(perf_counter())
+
+
+    def end(self):
+        end     = perf_counter()
+        stack   = tuple(self.stack)
+        code    = self.stacks.get(stack)
+        if code is None:
+            code = self.stacks[stack] = len(self.stacks)
+        i                   = self.n % self.capacity
+        self.start_time[i]  = self.starts.pop()
+        self.end_time[i]    = end
+        self.stack_code[i]  = code
+        self.trial_nr[i]    = self.trial
+        self.stack.pop()
+        self.n             += 1
+
+
+    def records(self):
+        # recorded phases in the order they ended (oldest first): start, end (s since the profiler was made), stack, trial
+        if not self.enabled or self.n == 0:
+            return []
+        order   = np.arange(max(0, self.n - self.capacity), self.n) % self.capacity
+        stacks  = {code: stack for stack, code in self.stacks.items()}
+        return [(self.start_time[i] - self.origin, self.end_time[i] - self.origin, stacks[self.stack_code[i]], int(self.trial_nr[i])) for i in order]
+
+
+    def chrome_trace(self):
+        events = [{'name': stack[-1], 'cat': '/'.join(stack[:-1]) or 'session', 'ph': 'X', 'pid': 1, 'tid': 1,
+                   'ts': round(start * 1e6, 3), 'dur': round((end - start) * 1e6, 3), 'args': {'trial': trial}}
+                  for start, end, stack, trial in self.records()]
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+    def folded_stacks(self):
+        # self time (us) per stack: duration minus the time of the phases inside it
+        totals      = {}
+        child_time  = {}
+        for start, end, stack, trial in self.records(): # a phase ends after the phases inside it
+            depth               = len(stack)
+            duration            = end - start
+            self_time           = duration - child_time.pop(depth + 1, 0.0)
+            child_time[depth]   = child_time.get(depth, 0.0) + duration
+            totals[stack]       = totals.get(stack, 0.0) + self_time
+        return ['%s %d' % (';'.join(stack), round(t * 1e6)) for stack, t in totals.items() if t > 0]
+
+
+    def export(self, file_name):
+        if not self.enabled:
+            return
+        with open(file_name + '_trace.json', 'w') as f:
+            json.dump(self.chrome_trace(), f)
+        with open(file_name + '_folded.txt', 'w') as f:
+            f.write('\n'.join(self.folded_stacks()) + '\n')
+
+
+
+if __name__ == '__main__':
+    n = 10**6
+    for enabled in (False, True):
+        profiler = Profiler(enabled)
+        start = perf_counter()
+        for i in range(n):
+            with profiler.phase('poll'):
+                pass
+        hook = (perf_counter() - start) / n
+
+        start = perf_counter()
+        for i in range(n):
+            pass
+        empty = (perf_counter() - start) / n
+        print('%s: %.3f us per hook' % ('enabled ' if enabled else 'disabled', (hook - empty) * 1e6))
@@ -0,0 +1,340 @@
+"""
+Offline replay of logged trials of the Beehives Paradigm (QA, figures, videos)
+
+- Reads a data file (Data/DotsTask_subN.csv) and the dot coordinates of every trial, from the dot store
+  (dot_store.py) or from the string-encoded dot lists of older data files.
+- Every trial is rendered offscreen with PIL, as the participant saw it: fixation cross, beehives, every bee for the
+  duration it was really on screen (dot durations in the dot store, pre_dots_duration/post_dots_duration in older data files,
+  nominal durations when neither is there),
+  time-out slide, feedback, confidence question and ITI. Screen coordinates are PsychoPy pixels (center 0,0, y up).
+- Several bees per dot and trails (dots_per_frame/trail_length in the data file, dot_field.py): the bees of one dot
+  are shown together, with the bees of the previous dots fading out as in the experiment.
+- Trials are rendered in a process pool. Only a few trials are in flight at once (bounded window of futures) and
+  frames are passed on as PNG images with a repeat count, so a whole session is never held in memory.
+- Frames are streamed to ffmpeg (--video) or written as PNG files (--frames).
+- The means of the replayed coordinates are checked against pre_dots_location_mean and post_dots_location_mean.
+- Durations and the position of the beehives come from the design saved with the schedule of the session
+  (design.session_config, default_config for older sessions).
+
+Usage: python replay.py Data/DotsTask_sub3.csv [--rows 0-19] [--video sub3.mp4 | --frames frames/] [--workers 4]
+"""
+
+import argparse
+import csv
+import io
+import os
+import shutil
+import subprocess
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from analysis import number, to_float
+from design import session_config
+from dot_store import DotStoreReader, store_files
+
+
+# Same values as in BeehivesParadigm_2023_01.py (durations and dif_lvl: design of the session)
+beehive_size    = 18
+bee_size        = 10
+timeout_slide   = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Instructions', 'Slide11.JPG')
+timeout_ms      = 1000      # how long the time-out slide is shown (waits for space in the experiment)
+conf_question   = 'How confident are you that you made the correct choice?'
+conf_labels     = ['Definitely correct       Probably correct        Guess correct               Guess wrong         Probably error      Definitely wrong',
+                   'Definitely wrong         Probably error      Guess wrong                Guess correct        Probably correct        Definitely correct']
+
+
+
+###############
+# Data access #
+###############
+
+def legacy_coords(text):
+    # '[(np.float64(1.5), np.float64(-3.2)), ...]' -> (n, 2) array
+    values = [float(v) for v in number.findall(text.replace('np.float64', ''))]
+    return np.array(values, dtype=np.float64).reshape(-1, 2)
+
+
+def durations(text):
+    # '[100.02, 99.98]' -> [100.02, 99.98] (missing column: empty list)
+    return [float(v) for v in number.findall(text or '')]
+
+
+def read_trials(csv_file, rows=None):
+    # yields one dict per trial with the columns needed for the replay and the dot coordinates
+    with open(csv_file, newline='') as f:
+        data = list(csv.DictReader(f))
+    base    = os.path.splitext(csv_file)[0]
+    store   = DotStoreReader(base) if data and 'dots_index' in data[0] and os.path.isfile(store_files(base)[1]) else None
+
+    for row_number in (rows if rows is not None else range(len(data))):
+        row = data[row_number]
+        if store is not None:
+            index       = int(to_float(row['dots_index']))
+            pre, post   = np.array(store.pre(index), dtype=np.float64), np.array(store.post(index), dtype=np.float64)
+        else:
+            pre, post   = legacy_coords(row.get('pre_dots_location', '')), legacy_coords(row.get('post_dots_location', ''))
+        if store is not None and store.durations is not None:
+            pre_durations, post_durations = store.pre_durations(index).tolist(), store.post_durations(index).tolist()
+        else: # durations as text in the csv file (older data files) or not logged
+            pre_durations, post_durations = durations(row.get('pre_dots_duration')), durations(row.get('post_dots_duration'))
+        yield {
+            'row':          row_number,
+            'sub':          int(to_float(row.get('sub'))),
+            'block':        int(to_float(row.get('block'))),
+            'trial':        int(to_float(row.get('trial'))),
+            'response':     row.get('response', ''),
+            'accuracy':     to_float(row.get('accuracy')),
+            'rt':           to_float(row.get('rt')),
+            'cj':           to_float(row.get('cj')),
+            'RTconf':       to_float(row.get('RTconf')),
+            'frame_ms':     to_float(row.get('frame_ms')) if to_float(row.get('frame_ms')) > 0 else 1000 / 60,
+            'dots_per_frame':   max(int(to_float(row.get('dots_per_frame', 1))), 1),
+            'trail_length':     max(int(to_float(row.get('trail_length', 0))), 0),
+            'pre_mean':     to_float(row.get('pre_dots_location_mean')),
+            'post_mean':    to_float(row.get('post_dots_location_mean')),
+            'pre_durations':    pre_durations,
+            'post_durations':   post_durations,
+            'pre':          pre,
+            'post':         post,
+        }
+
+
+def verify(trial, tolerance=1e-3):
+    # logged means vs. replayed coordinates (the dot store has float32 coordinates), returns a list of problems
+    problems = []
+    if len(trial['pre']) and abs(trial['pre'][:, 0].mean() - trial['pre_mean']) > tolerance * max(1, abs(trial['pre_mean'])):
+        problems.append('pre_dots_location_mean %.4f, replayed %.4f' % (trial['pre_mean'], trial['pre'][:, 0].mean()))
+    if len(trial['post']) and abs(trial['post'][:, 0].mean() - trial['post_mean']) > tolerance * max(1, abs(trial['post_mean'])):
+        problems.append('post_dots_location_mean %.4f, replayed %.4f' % (trial['post_mean'], trial['post'][:, 0].mean()))
+    if not len(trial['post']) and trial['post_mean'] != -99:
+        problems.append('post_dots_location_mean %.4f but no post-decisional dots' % trial['post_mean'])
+    return problems
+
+
+
+#############
+# Rendering #
+#############
+
+class Renderer:
+
+    def __init__(self, size, config):
+        from PIL import Image, ImageDraw, ImageFont
+        self.Image, self.ImageDraw, self.ImageFont = Image, ImageDraw, ImageFont
+        self.size       = size
+        self.config     = config
+        self.timeline   = config['timeline_ms']
+        beehive_x       = max(config['dif_lvl']) # beehives at (-max(dif_lvl), 0) and (max(dif_lvl), 0)
+        self.blank      = Image.new('RGB', size, 'black')
+        self.fixation   = self._draw(self.blank.copy(), lambda d: self._cross(d))
+        self.beehives   = self._draw(self.fixation.copy(), lambda d: [self._circle(d, (x, 0), beehive_size, 'yellow') for x in (-beehive_x, beehive_x)])
+        self.good       = self._draw(self.blank.copy(), lambda d: self._text(d, 'Correct!', (0, 0), 40, 'green'))
+        self.bad        = self._draw(self.blank.copy(), lambda d: self._text(d, 'Incorrect...', (0, 0), 40, 'red'))
+        self.timeout    = self._slide(timeout_slide) if os.path.isfile(timeout_slide) else \
+                          self._draw(self.blank.copy(), lambda d: self._text(d, 'Try to respond faster (press SPACE)', (0, 0), 30, 'white'))
+        self.confidence = [self._draw(self.blank.copy(), lambda d, labels=labels: (self._text(d, conf_question, (0, 300), 30, 'white'),
+                                                                                   self._text(d, labels, (0, 0), 30, 'white')))
+                           for labels in conf_labels]
+
+
+    def _screen(self, pos):
+        return self.size[0] / 2 + pos[0], self.size[1] / 2 - pos[1]
+
+
+    def _draw(self, image, function):
+        function(self.ImageDraw.Draw(image))
+        return image
+
+
+    def _circle(self, draw, pos, diameter, color):
+        x, y = self._screen(pos)
+        draw.ellipse((x - diameter / 2, y - diameter / 2, x + diameter / 2, y + diameter / 2), fill=color)
+
+
+    def _cross(self, draw, height=50, color=(128,128,128)):
+        x, y = self._screen((0, 0))
+        draw.line((x - height / 4, y, x + height / 4, y), fill=color, width=4)
+        draw.line((x, y - height / 4, x, y + height / 4), fill=color, width=4)
+
+
+    def _text(self, draw, text, pos, height, color):
+        try:
+            font = self.ImageFont.load_default(size=height)
+        except TypeError: # older Pillow: fixed size bitmap font
+            font = self.ImageFont.load_default()
+        left, top, right, bottom = draw.textbbox((0, 0), text, font=font)
+        x, y = self._screen(pos)
+        draw.text((x - (right - left) / 2, y - (bottom - top) / 2), text, fill=color, font=font)
+
+
+    def _slide(self, file_name):
+        slide = self.Image.open(file_name).convert('RGB')
+        slide.thumbnail(self.size)
+        image = self.blank.copy()
+        image.paste(slide, ((self.size[0] - slide.width) // 2, (self.size[1] - slide.height) // 2))
+        return image
+
+
+    def bees(self, steps, trail_length=0):
+        # bees of the last dot steps (oldest first): the newest in white, older ones fading out (opacity 1 - age/(trail_length+1))
+        def draw(d):
+            for i, step in enumerate(steps):
+                level = int(round(255 * (1 - (len(steps) - 1 - i) / (trail_length + 1))))
+                for pos in step:
+                    self._circle(d, pos, bee_size, (level, level, level))
+        return self._draw(self.beehives.copy(), draw)
+
+
+    def trial(self, trial):
+        # list of (image, number of frames) in the order they were on screen
+        frame_ms    = trial['frame_ms']
+        frames      = lambda ms: max(1, int(round(ms / frame_ms)))
+        nominal     = frames(self.timeline['dot'])
+        responded   = trial['rt'] != -99
+
+        shown       = [(self.fixation, frames(self.timeline['fixation'])), (self.beehives, frames(self.timeline['beehives']))]
+        history     = [] # bees of the dots still on screen (trail), the trail goes on from the pre- into the post-decisional dots
+        for dots, logged in ((trial['pre'], trial['pre_durations']), (trial['post'], trial['post_durations'])):
+            steps = dots.reshape(-1, trial['dots_per_frame'], 2) # bees of one dot are consecutive in the dot store
+            for i, step in enumerate(steps):
+                n = frames(logged[i]) if i < len(logged) else nominal
+                if dots is trial['pre'] and responded and i == len(steps) - 1 and not logged: # dot of the response: until the key press
+                    n = max(1, frames(trial['rt'] * 1000) - nominal * i)
+                history = (history + [step])[-(trial['trail_length'] + 1):]
+                shown.append((self.bees(history, trial['trail_length']), n))
+        if not responded:
+            shown.append((self.timeout, frames(timeout_ms)))
+        shown.append((self.blank, frames(self.timeline['blank'])))
+        if trial['block'] == 0 and responded:
+            shown.append((self.good if trial['accuracy'] == 1 else self.bad, frames(self.timeline['feedback'])))
+        if trial['cj'] != -99:
+            shown.append((self.confidence[trial['sub'] % 2], frames(trial['RTconf'] * 1000)))
+        shown.append((self.blank, frames(self.timeline['iti'])))
+        return shown
+
+
+
+_renderer = None
+
+def render_trial(job):
+    # runs in a worker process: returns the frames of one trial as (png bytes, number of frames)
+    global _renderer
+    trial, size, config = job
+    if _renderer is None or _renderer.size != size or _renderer.config != config:
+        _renderer = Renderer(size, config)
+    encoded = []
+    for image, n_frames in _renderer.trial(trial):
+        buffer = io.BytesIO()
+        image.save(buffer, format='PNG', compress_level=1)
+        encoded.append((buffer.getvalue(), n_frames))
+    return encoded
+
+
+
+#########
+# Sinks #
+#########
+
+class VideoSink:
+    # frames are piped to ffmpeg as a PNG stream at the frame rate of the experiment
+
+    def __init__(self, file_name, fps):
+        if shutil.which('ffmpeg') is None:
+            sys.exit('ffmpeg not found (use --frames to write PNG files)')
+        self.process = subprocess.Popen(['ffmpeg', '-y', '-loglevel', 'error', '-f', 'image2pipe', '-framerate', '%.4f' % fps,
+                                         '-vcodec', 'png', '-i', '-', '-pix_fmt', 'yuv420p', '-vcodec', 'libx264', file_name],
+                                        stdin=subprocess.PIPE)
+        self.n_frames = 0
+
+    def write(self, png, n_frames):
+        for i in range(n_frames):
+            self.process.stdin.write(png)
+        self.n_frames += n_frames
+
+    def close(self):
+        self.process.stdin.close()
+        self.process.wait()
+
+
+
+class FrameSink:
+    # every frame as a numbered PNG file
+
+    def __init__(self, folder):
+        os.makedirs(folder, exist_ok=True)
+        self.folder     = folder
+        self.n_frames   = 0
+
+    def write(self, png, n_frames):
+        for i in range(n_frames):
+            with open(os.path.join(self.folder, 'frame_%07d.png' % self.n_frames), 'wb') as f:
+                f.write(png)
+            self.n_frames += 1
+
+    def close(self):
+        pass
+
+
+
+def replay(csv_file, sink, rows=None, size=(1280, 720), workers=None):
+    # renders the trials in a process pool and writes them in order, returns the verification problems
+    problems    = {}
+    in_flight   = deque()
+    window      = 2 * (workers or os.cpu_count() or 1) # trials in flight (memory use does not grow with the session)
+    config      = session_config(os.path.splitext(csv_file)[0])
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for trial in read_trials(csv_file, rows):
+            trial_problems = verify(trial)
+            if trial_problems:
+                problems[trial['row']] = trial_problems
+            if sink is not None:
+                in_flight.append(pool.submit(render_trial, (trial, size, config)))
+                if len(in_flight) >= window:
+                    for png, n_frames in in_flight.popleft().result():
+                        sink.write(png, n_frames)
+        while in_flight:
+            for png, n_frames in in_flight.popleft().result():
+                sink.write(png, n_frames)
+    return problems
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay logged trials offscreen, render them to a video or PNG frames and verify the logged means')
+    parser.add_argument('csv_file', help='data file, e.g. Data/DotsTask_sub3.csv')
+    parser.add_argument('--rows', default=None, help='trials (rows of the data file, from 0), e.g. 0-19 or 3,7 (default: all)')
+    parser.add_argument('--video', default=None, help='video file (needs ffmpeg)')
+    parser.add_argument('--frames', default=None, help='folder for PNG frames')
+    parser.add_argument('--size', default='1280x720', help='frame size in pixels')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    rows = None
+    if args.rows:
+        if '-' in args.rows:
+            first, last = map(int, args.rows.split('-'))
+            rows        = range(first, last + 1)
+        else:
+            rows        = [int(r) for r in args.rows.split(',')]
+    size = tuple(int(v) for v in args.size.split('x'))
+
+    sink = None
+    if args.video:
+        first_trial = next(read_trials(args.csv_file, [rows[0] if rows else 0]))
+        sink        = VideoSink(args.video, 1000 / first_trial['frame_ms'])
+    elif args.frames:
+        sink        = FrameSink(args.frames)
+
+    problems = replay(args.csv_file, sink, rows, size, args.workers)
+    if sink is not None:
+        sink.close()
+        print('%d frames written to %s' % (sink.n_frames, args.video or args.frames))
+
+    for row, row_problems in sorted(problems.items()):
+        print('row %d: %s' % (row, '; '.join(row_problems)))
+    if problems:
+        sys.exit('%d trials do not match the logged means' % len(problems))
+    print('Logged means match the replayed coordinates')
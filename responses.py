@@ -0,0 +1,61 @@
+"""
+Response collection for the Beehives Paradigm
+
+- Uses psychopy.hardware.keyboard: key presses are collected by a background thread (psychtoolbox/iohub backend)
+  and timestamped by the keyboard driver instead of when the script happens to check the keyboard.
+- poll() is called after every flip, so dot presentation can stop on the very next frame after a key press.
+- The response clock is reset on the flip of the stimulus onset (window.callOnFlip), so rt is relative to what was on screen.
+- onset latency: time between the key press and the first frame that reacted to it (first post-decisional dot).
+"""
+
+
+class ResponseCollector:
+
+    def __init__(self, window, device=None):
+        # device: object with the Keyboard interface (clock, clearEvents, getKeys, waitKeys), e.g. a mock in benchmarks.py
+        if device is None:
+            from psychopy.hardware import keyboard
+            device = keyboard.Keyboard()
+        self.window         = window
+        self.keyboard       = device
+        self.clock          = self.keyboard.clock
+        self.key            = None
+        self.onset_latency  = -99
+
+
+    def new_trial(self):
+        # before the choice of a trial: no key and no onset latency yet
+        self.clear()
+        self.onset_latency  = -99
+
+
+    def clear(self):
+        # e.g. before the confidence question (keeps the onset latency of the choice)
+        self.keyboard.clearEvents()
+        self.key            = None
+
+
+    def reset_clock_on_flip(self):
+        # rt will be relative to the next flip (call right before the flip of the stimulus onset)
+        self.window.callOnFlip(self.clock.reset)
+
+
+    def poll(self, key_list):
+        # returns the first new key press (name, rt, tDown) or None, does not wait
+        keys = self.keyboard.getKeys(keyList=key_list, waitRelease=False, clear=True)
+        if keys:
+            self.key = keys[0]
+            return self.key
+        return None
+
+
+    def wait(self, key_list):
+        keys        = self.keyboard.waitKeys(keyList=key_list, waitRelease=False, clear=True)
+        self.key    = keys[0]
+        return self.key
+
+
+    def mark_onset(self):
+        # call right after the first flip that reacts to the key press
+        self.onset_latency = self.clock.getTime() - self.key.rt
+        return self.onset_latency
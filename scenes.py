@@ -0,0 +1,26 @@
+"""
+Pre-composited static scenes for the Beehives Paradigm
+
+- Stimuli that are always drawn together (fixation cross + beehives, confidence question + labels, ...)
+  are rendered once into a single BufferImageStim, so each frame only needs one draw call for the static part.
+- With composite=False the stimuli are drawn one by one (same interface), e.g. to check a scene against the original.
+"""
+
+
+class StimGroup:
+
+    def __init__(self, stims):
+        self.stims = list(stims)
+
+    def draw(self):
+        for stim in self.stims:
+            stim.draw()
+
+
+def make_scene(window, stims, composite=True):
+    if not composite:
+        return StimGroup(stims)
+
+    from psychopy import visual
+    # draws the stimuli in the back buffer, captures it as one texture and clears the back buffer again
+    return visual.BufferImageStim(window, stim=list(stims))
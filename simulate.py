@@ -0,0 +1,228 @@
+"""
+Headless simulation of the Beehives Paradigm
+
+- Runs the same block/trial sequence as the experiment script (schedule compiled by design.py: practice block, main blocks, shift in
+  post-decisional evidence, accuracy relative to the average evidence, confidence only in the last blocks)
+  without any window or keyboard. Variables have the values of the data file (e.g. cj 1..6, -99 for timed-out trials).
+- Responses come from a simulated observer. The default is a sequential sampling agent:
+  noisy evidence from every dot is accumulated until a bound is reached, confidence is read out from the
+  evidence after the post-decisional dots, and the starting point can depend on the previous choice and confidence.
+- Everything is vectorized over virtual subjects (one loop over trials, numpy over subjects),
+  so thousands of sessions run in seconds. Dots are drawn in float32 and in two chunks: the second chunk
+  is only drawn for the virtual subjects that have not responded within the first one.
+
+Usage: python simulate.py --subjects 10000
+       python simulate.py --power --subjects 40 --studies 1000
+"""
+
+import argparse
+from time import perf_counter
+
+import numpy as np
+
+import task_logic
+from design import compile_schedule, default_config
+
+
+# Design of the experiment (same config as design.py and the experiment script)
+design = default_config
+
+
+
+class SequentialSamplingObserver:
+    # All parameters can be a single value or an array with one value per virtual subject
+
+    def __init__(self, drift_gain=1.0, noise=1.0, bound=3.0, latency_dots=1, conf_gain=1.0,
+                 conf_criteria=(-2.0, -1.0, 0.0, 1.0, 2.0), sequential_bias=0.0):
+        self.drift_gain         = np.asarray(drift_gain, dtype=np.float64)
+        self.noise              = np.asarray(noise, dtype=np.float64)
+        self.bound              = np.asarray(bound, dtype=np.float64)
+        self.latency_dots       = np.asarray(latency_dots, dtype=np.int64)   # dots from bound crossing to the dot during which the key is pressed
+        self.conf_gain          = np.asarray(conf_gain, dtype=np.float64)
+        self.conf_criteria      = np.asarray(conf_criteria, dtype=np.float64) # 5 criteria -> 6 confidence levels
+        self.sequential_bias    = np.asarray(sequential_bias, dtype=np.float64) # starting point towards previous choice, scaled by previous confidence
+
+
+    def starting_point(self, prev_choice_right, prev_cj):
+        # prev_cj is -99 when no confidence was given (no bias), 1..6 otherwise (6: definitely correct)
+        has_conf    = prev_cj > 0
+        direction   = np.where(prev_choice_right, 1.0, -1.0)
+        return np.where(has_conf, self.sequential_bias * direction * (prev_cj - 3.5) / 2.5, 0.0)
+
+
+    def decide(self, x, width, start, rng, subjects=slice(None)):
+        # x: (subjects, dots) x coordinates of the bees, start: accumulated evidence before the first of these dots
+        # subjects: which virtual subjects these rows are (for subject-specific parameters)
+        # returns index of the dot at which the bound is crossed (-1: never), choice and accumulated evidence
+        # (at the crossing, or after the last dot if the bound was not reached, so the next dots can continue from there)
+        n_sub, n_dots   = x.shape
+        samples         = self._param(self.drift_gain, subjects) * x / width + self._param(self.noise, subjects) * rng.standard_normal((n_sub, n_dots), dtype=np.float32)
+        evidence        = np.cumsum(samples, axis=1) + start[:, None]
+
+        crossed         = np.abs(evidence) >= self._param(self.bound, subjects)
+        decided         = crossed.any(axis=1)
+        decision_dot    = np.where(decided, crossed.argmax(axis=1), -1)
+
+        at_decision     = evidence[np.arange(n_sub), np.where(decided, decision_dot, n_dots - 1)]
+        return decision_dot, at_decision > 0, at_decision
+
+
+    def confidence(self, post_x, width, chose_right, rng):
+        # evidence from the post-decisional dots in the direction of the choice, mapped onto 6 levels (1: sure error, 6: sure correct)
+        n_sub, n_dots   = post_x.shape
+        samples         = self._param(self.drift_gain) * post_x / width + self._param(self.noise) * rng.standard_normal((n_sub, n_dots))
+        direction       = np.where(chose_right, 1.0, -1.0)
+        post_evidence   = direction * self.conf_gain * samples.sum(axis=1)
+        return np.searchsorted(self.conf_criteria, post_evidence) + 1
+
+
+    @staticmethod
+    def _param(value, subjects=slice(None)):
+        return value[subjects][:, None] if value.ndim == 1 else value
+
+
+
+def run_sessions(n_subjects, observer=None, seed=None, design=design, first_sub=0, chunk_dots=12):
+    # Returns a dict of (subjects, trials) arrays with the same variables as the data file
+    observer    = observer if observer is not None else SequentialSamplingObserver()
+    rng         = np.random.default_rng(seed)
+    S           = n_subjects
+    sub         = np.arange(first_sub, first_sub + S)
+    rows        = np.arange(S)
+    max_dots    = design['max_dots']
+    chunk_dots  = min(chunk_dots, max_dots)
+    latency     = np.broadcast_to(observer.latency_dots, (S,))
+
+    width       = design['width']
+
+    # trial sequence of every subject (same compiler as the experiment, shuffled per subject and per block)
+    schedule    = compile_schedule(design, sub, rng.integers(2**32))
+    n_trials    = schedule.shape[1]
+    out         = {name: np.full((S, n_trials), -99, dtype=np.float64) for name in
+                   ('block', 'trial', 'difficulty', 'distance', 'target_right', 'stronger', 'response_right',
+                    'accuracy', 'rt', 'cj', 'pre_dots_location_mean', 'post_dots_location_mean', 'n_pre_dots', 'shift')}
+
+    prev_choice = np.zeros(S, dtype=bool)
+    prev_cj     = np.full(S, -99)
+    column      = 0
+
+    for block in np.unique(schedule[0]['block']):
+        trials      = schedule[:, schedule[0]['block'] == block]
+        main        = trials[0, 0]['main']
+        shft        = trials[:, 0]['shift'].astype(np.float64) # 0 in practice and first main block
+        conf_block  = trials[0, 0]['confidence']
+
+        for trial_number in range(trials.shape[1]):
+            d, r, st    = trials['difficulty'][:, trial_number], trials['target_right'][:, trial_number], trials['stronger'][:, trial_number]
+            mean        = task_logic.generative_mean(d, r)
+
+            # first chunk of dots for everybody
+            x           = np.zeros((S, max_dots), dtype=np.float32)
+            x[:, :chunk_dots] = rng.standard_normal((S, chunk_dots), dtype=np.float32) * np.float32(width) + mean[:, None].astype(np.float32)
+            decision_dot, chose_right, at_decision = observer.decide(x[:, :chunk_dots], width, observer.starting_point(prev_choice, prev_cj), rng)
+
+            # remaining dots only for subjects that did not respond within the first chunk
+            more        = np.flatnonzero((decision_dot < 0) | (decision_dot + latency >= chunk_dots))
+            if len(more) and chunk_dots < max_dots:
+                x[more, chunk_dots:] = rng.standard_normal((len(more), max_dots - chunk_dots), dtype=np.float32) * np.float32(width) + mean[more, None].astype(np.float32)
+                undecided   = more[decision_dot[more] < 0]
+                later_dot, later_right, later_evidence = observer.decide(x[undecided, chunk_dots:], width, at_decision[undecided], rng, undecided)
+                decision_dot[undecided] = np.where(later_dot >= 0, later_dot + chunk_dots, -1)
+                chose_right[undecided]  = later_right
+                at_decision[undecided]  = later_evidence
+
+            # the key press comes during a later dot (the keyboard is checked every frame): that dot is shown (and saved) until the press,
+            # rt is the dots before it plus the time of the press within the dot
+            key_dot     = decision_dot + latency
+            responded   = (decision_dot >= 0) & (key_dot < max_dots)
+            key_dot     = np.where(responded, key_dot, max_dots - 1)
+            n_pre       = key_dot + 1
+            dot_sum     = np.cumsum(x[:, :chunk_dots], axis=1, dtype=np.float64)[rows, np.minimum(key_dot, chunk_dots - 1)]
+            if len(more):
+                dot_sum[more] = np.cumsum(x[more], axis=1, dtype=np.float64)[np.arange(len(more)), key_dot[more]]
+            mean_dots   = dot_sum / n_pre
+
+            mean_add    = mean_dots
+            if main:
+                mean_add = task_logic.post_decision_mean(mean_dots, st, shft)
+            post_x      = rng.standard_normal((S, design['add_dots'])) * design['width_add'] + mean_add[:, None]
+
+            acc         = task_logic.score_accuracy(mean_dots, chose_right)
+            if conf_block: # rating as in the data file (the same for both label orders)
+                cj      = observer.confidence(post_x, width, chose_right, rng)
+            else:
+                cj      = np.full(S, -99)
+
+            values = {
+                'block':                    block,
+                'trial':                    trial_number + 1,
+                'difficulty':               d,
+                'distance':                 mean,
+                'target_right':             r,
+                'stronger':                 st,
+                'response_right':           np.where(responded, chose_right, -99),
+                'accuracy':                 np.where(responded, acc, -99),
+                'rt':                       np.where(responded, (key_dot + rng.random(S)) * design['timeline_ms']['dot'] / 1000, -99),
+                'cj':                       np.where(responded, cj, -99),
+                'pre_dots_location_mean':   mean_dots,
+                'post_dots_location_mean':  np.where(responded, post_x.mean(axis=1), -99),
+                'n_pre_dots':               n_pre,
+                'shift':                    shft,
+            }
+            for name, value in values.items():
+                out[name][:, column] = value
+
+            prev_choice = np.where(responded, chose_right, prev_choice)
+            prev_cj     = np.where(responded, cj, -99)
+            column     += 1
+
+    out['sub'] = sub
+    return out
+
+
+
+def repetition_by_confidence(results):
+    # per subject: P(repeat previous choice | previous confidence high) - P(repeat | previous confidence low)
+    choice      = results['response_right']
+    cj          = results['cj']
+    valid       = (choice[:, 1:] >= 0) & (choice[:, :-1] >= 0) & (cj[:, :-1] > 0) & (results['block'][:, 1:] == results['block'][:, :-1])
+    repeat      = choice[:, 1:] == choice[:, :-1]
+    high        = valid & (cj[:, :-1] >= 5)
+    low         = valid & (cj[:, :-1] <= 2)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (repeat & high).sum(axis=1) / high.sum(axis=1) - (repeat & low).sum(axis=1) / low.sum(axis=1)
+
+
+def power_analysis(n_subjects, n_studies, observer=None, seed=None, alpha=0.05):
+    # proportion of simulated studies with a significant repetition-by-confidence effect (one sample t-test)
+    from scipy import stats
+    effect  = repetition_by_confidence(run_sessions(n_subjects * n_studies, observer, seed)).reshape(n_studies, n_subjects)
+    n       = np.sum(~np.isnan(effect), axis=1)
+    t       = np.nanmean(effect, axis=1) / (np.nanstd(effect, axis=1, ddof=1) / np.sqrt(n))
+    p       = 2 * stats.t.sf(np.abs(t), n - 1)
+    return np.mean(p < alpha)
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Headless simulation of the Beehives Paradigm')
+    parser.add_argument('--subjects', type=int, default=1000, help='number of virtual subjects (per study with --power)')
+    parser.add_argument('--studies', type=int, default=100, help='number of simulated studies for --power')
+    parser.add_argument('--bias', type=float, default=0.5, help='confidence-dependent starting point bias of the observer')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--power', action='store_true', help='estimate power to detect the repetition-by-confidence effect')
+    args = parser.parse_args()
+
+    observer    = SequentialSamplingObserver(sequential_bias=args.bias)
+    start       = perf_counter()
+    if args.power:
+        power   = power_analysis(args.subjects, args.studies, observer, args.seed)
+        print('Power with %d subjects: %.3f (%d studies)' % (args.subjects, power, args.studies))
+        n_sessions = args.subjects * args.studies
+    else:
+        results = run_sessions(args.subjects, observer, args.seed)
+        responded = results['accuracy'] >= 0
+        print('Accuracy: %.3f   Timed-out: %.3f   Mean RT: %.3f s' % (results['accuracy'][responded].mean(), 1 - responded.mean(), results['rt'][responded].mean()))
+        print('Repetition effect (high - low confidence): %.3f' % np.nanmean(repetition_by_confidence(results)))
+        n_sessions = args.subjects
+    print('%d sessions simulated in %.2f s' % (n_sessions, perf_counter() - start))
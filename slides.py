@@ -0,0 +1,64 @@
+"""
+Lazy loading of the instruction slides
+
+- Slides are only decoded when they are needed, instead of building all ImageStims at startup.
+- When a slide is requested the next one in order (the slides in the order they are shown) is decoded in a
+  background thread (prefetch), so it is ready by the time the participant presses space. Slides that are not
+  in order are never prefetched. The texture is made on the main thread (OpenGL context).
+- At most capacity slides are kept (least recently used are freed), slides in keep are never freed
+  (e.g. the 'try to be faster' slide that is shown after every timed-out trial).
+"""
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+def decode(file_name):
+    from PIL import Image
+    image = Image.open(file_name)
+    image.load() # decode now (in the background thread), not when the texture is made
+    return image
+
+
+class SlideCache:
+
+    def __init__(self, window, path_pattern, order, capacity=3, keep=()):
+        self.window         = window
+        self.path_pattern   = path_pattern # e.g. 'Instructions/Slide%d.JPG', slides are numbered from 1
+        self.next           = dict(zip(order, order[1:])) # slide -> slide shown after it
+        self.capacity       = capacity
+        self.keep           = set(keep)
+        self.stims          = OrderedDict()
+        self.decoding       = {}
+        self.executor       = ThreadPoolExecutor(max_workers=1, thread_name_prefix='SlideCache')
+
+
+    def prefetch(self, index):
+        if index is not None and index not in self.stims and index not in self.decoding:
+            self.decoding[index] = self.executor.submit(decode, self.path_pattern % (index + 1))
+
+
+    def __getitem__(self, index):
+        if index not in self.stims:
+            from psychopy import visual
+            self.prefetch(index)
+            image = self.decoding.pop(index).result()
+            self.stims[index] = visual.ImageStim(self.window, image)
+            self._evict()
+        self.stims.move_to_end(index)
+        self.prefetch(self.next.get(index))
+        return self.stims[index]
+
+
+    def release(self, index):
+        # free a slide that will not be shown again
+        if index not in self.keep:
+            self.stims.pop(index, None)
+
+
+    def _evict(self):
+        for index in list(self.stims):
+            if len(self.stims) <= self.capacity:
+                break
+            if index not in self.keep:
+                del self.stims[index]
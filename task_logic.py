@@ -0,0 +1,39 @@
+"""
+Task logic of the Beehives Paradigm without any PsychoPy calls
+
+- Used by the experiment script, the design compiler (design.py) and the headless simulation (simulate.py), so all run the same rules.
+- All functions work on single values (experiment) and on numpy arrays (many virtual subjects at once).
+"""
+
+import numpy as np
+
+
+target_side = ["left","right"]
+post_evi    = ["stronger","weaker"]
+
+
+def generative_mean(difficulty, target_right):
+    # mean of the generative distribution of the bee positions (x,y)
+    return np.where(target_right, difficulty, -difficulty)
+
+
+def post_decision_mean(mean_dots, stronger, shft):
+    # shift the mean of the post-decisional evidence away from the center (stronger) or towards the other side (weaker)
+    stronger = np.asarray(stronger)
+    away = ((mean_dots > 0) & stronger) | ((mean_dots <= 0) & ~stronger)
+    return np.where(away, mean_dots + shft, mean_dots - shft)
+
+
+def score_accuracy(mean_dots, chose_right):
+    # a choice is correct when it matches the side of the average evidence (not the generative mean)
+    return np.where((mean_dots >= 0) == chose_right, 1, 0)
+
+
+def confidence_rating(key_index, sub):
+    # convert index in cj_keys into numeric value from 1 (sure error) to 6 (sure correct), reversed order for half
+    cj = np.asarray(key_index) + 1
+    return np.where(np.asarray(sub) % 2 < 1, 7 - cj, cj)
+
+
+def is_confidence_block(block, nb_total_blocks, nb_conf_blocks):
+    return block >= nb_total_blocks - nb_conf_blocks
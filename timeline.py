@@ -0,0 +1,34 @@
+"""
+Timeline of a trial in milliseconds, compiled into frame counts for the measured refresh rate
+
+- Durations are declared in ms (see timeline_ms in the experiment script) instead of hard-coded frame counts,
+  so the experiment runs on 60, 120, 144 Hz ... displays.
+- Each duration becomes the nearest whole number of frames (at least 1).
+  A warning is given when this changes the duration by more than tolerance_ms.
+- max_flips() is the number of flips of the longest possible trial (size of the frame timing buffers, frame_timing.py).
+"""
+
+import warnings
+
+
+def compile_timeline(timeline_ms, frame_ms, tolerance_ms=1.0):
+    frames = {}
+    for phase, duration in timeline_ms.items():
+        n_frames        = max(1, int(round(duration / frame_ms)))
+        frames[phase]   = n_frames
+        shown           = n_frames * frame_ms
+        if abs(shown - duration) > tolerance_ms:
+            warnings.warn('%s: %d ms cannot be shown exactly at %.2f ms per frame (%d frames = %.1f ms)'
+                          % (phase, duration, frame_ms, n_frames, shown))
+    return frames
+
+
+def max_flips(frames, max_dots, add_dots):
+    # every phase at its longest (all dots, post-decisional dots, feedback), one flip each for the time-out slide,
+    # the confidence question and the flip after saving the trial
+    return (frames['fixation'] + frames['beehives'] + (max_dots + add_dots) * frames['dot'] + frames['blank']
+            + frames['feedback'] + frames['iti'] + 3)
+
+
+def describe(frames, frame_ms):
+    return ', '.join('%s %d frames (%.1f ms)' % (phase, n, n * frame_ms) for phase, n in frames.items())
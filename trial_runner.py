@@ -0,0 +1,162 @@
+"""
+Trial loop of the Beehives Paradigm, shared by the experiment script and the headless benchmarks (benchmarks.py)
+
+- TrialRunner does the work of a trial that runs in between flips: sampling the dots before the first flip,
+  the frames of the static screens, the pre-decisional dots (keyboard checked after every frame), the post-decisional dots
+  and the data of the trial (same columns and values in the experiment and in the benchmarks).
+- Window, stimuli, keyboard (ResponseCollector), frame timer and profiler are passed in, so benchmarks.py runs this code with mocks.
+- With several bees per dot and/or trails (dot_field.py) every bee of a dot is saved and added to the evidence.
+- break_texts() computes the block summary and the texts of the break screens (runs in a background thread).
+"""
+
+import statistics
+
+import numpy as np
+
+import task_logic
+from evidence import EvidenceAccumulator
+from frame_timing import PRE_DOT, POST_DOT
+
+
+def break_texts(feedback_acc, feedback_rt, blocks_remaining, prev_feedback_acc, prev_feedback_rt, first_block):
+    # performance stats of a block and the texts of the two break screens
+    mean_rt         = round(statistics.mean(feedback_rt)*1000,0) # in ms
+    percentage_acc  = round(statistics.mean(feedback_acc) * 100,0)
+    text1           = 'Break :)  \n\n Blocks remaining: ' + str(blocks_remaining) + '\n\n\n\n Press SPACE to see performance summary'
+    if first_block: # in first block after practice no prev performance stats available
+        text2       = 'Average response time: ' + str(mean_rt) + ' ms \n\n Average accuracy: ' + str(percentage_acc) + '% \n\n\n\n\n Try to improve these scores by responding faster and more accurately! \n\n\n\n\n\n\n Press SPACE to continue the experiment.'
+    else: # first performance stats and those of previous round
+        text2       = 'Average response time: ' + str(mean_rt) + ' ms   (previous block: ' + str(prev_feedback_rt) + ' ms)\n\n Average accuracy: ' + str(percentage_acc) + '%   (previous block: ' + str(prev_feedback_acc) + '%) \n\n\n\n\n Try to improve these scores by responding faster and more accurately! \n\n\n\n\n\n\n Press SPACE to continue the experiment.'
+    return mean_rt, percentage_acc, (text1, text2)
+
+
+
+class TrialRunner:
+
+    def __init__(self, scene_dots, bee, timer, responses, sampler, profiler, frames, choice_keys, width, multi_dots=False):
+        # scene_dots: static scene behind the bees (fixation cross + beehives), bee: Circle or DotField (multi_dots)
+        self.scene_dots     = scene_dots
+        self.bee            = bee
+        self.timer          = timer
+        self.responses      = responses
+        self.sampler        = sampler
+        self.profiler       = profiler
+        self.frames         = frames
+        self.choice_keys    = choice_keys
+        self.multi_dots     = multi_dots
+
+        self.pre_evidence   = EvidenceAccumulator(width) # running statistics of the evidence, updated once per dot
+        self.post_evidence  = EvidenceAccumulator(width)
+
+
+    def start_trial(self, mean, difficulty, block, trial_number, seed):
+        # all dots of the trial are sampled at once, before the first flip of the trial
+        self.mean               = mean
+        self.difficulty         = difficulty
+        self.block              = block
+        self.trial_number       = trial_number
+        self.pre_dots           = self.sampler.prepare_trial(mean, block, trial_number, seed)
+        self.location_dots      = [] # to save coordinates of dots
+        self.location_add_dots  = [] # to save coordinates of post-decisional dots
+        self.key                = None
+        self.pre_evidence.reset(difficulty)
+        self.post_evidence.reset(difficulty)
+        if self.multi_dots:
+            self.bee.clear() # no trail from the previous trial
+        self.timer.start_trial()
+
+
+    def show_scene(self, scene, phase, n_frames):
+        # static screen (None: blank screen) for n_frames frames
+        for frameN in range(n_frames):
+            if scene is not None:
+                scene.draw()
+            self.timer.flip(phase)
+
+
+    def show_dots(self, dots, locations, evidence):
+        # bee position(s) of one dot: shown from the next draw on, saved and added to the evidence
+        if self.multi_dots:
+            self.bee.set_dots(dots)
+            for x,y in np.reshape(dots, (-1,2)): # (x,y) when only trails are used
+                locations.append((x,y))
+                evidence.add(x)
+        else:
+            x,y             = dots
+            self.bee.pos    = (x,y)
+            locations.append((x,y)) # save dot location
+            evidence.add(x)
+
+
+    def pre_decision(self):
+        # present dots until a choice key is pressed (checked after every frame), returns the key or None (timed-out)
+        self.responses.new_trial()
+        for number in range(len(self.pre_dots)):
+            self.show_dots(self.pre_dots[number], self.location_dots, self.pre_evidence)
+            for frameN in range(self.frames['dot']):
+                self.scene_dots.draw()
+                self.bee.draw()
+                if number == 0 and frameN == 0:
+                    self.responses.reset_clock_on_flip() # rt relative to onset first dot
+                self.timer.flip(PRE_DOT, number+1)
+
+                with self.profiler.phase('poll'):
+                    self.key = self.responses.poll(self.choice_keys)
+                if self.key is not None: # stop stimulus presentation on the next frame
+                    return self.key
+        return None
+
+
+    def post_decision(self, stronger, shft):
+        # post-decisional dots, drawn around the mean x coordinate of the dots
+        # shifted away from (stronger) or towards (weaker) the other side, shft is 0 in the training block and first main block
+        mean_add_dots   = float(task_logic.post_decision_mean(self.pre_evidence.mean, stronger, shft))
+        post_dots       = self.sampler.post_dots(mean_add_dots) # affine transform of pre-drawn samples
+        for number in range(len(post_dots)):
+            self.show_dots(post_dots[number], self.location_add_dots, self.post_evidence)
+            for frameN in range(self.frames['dot']):
+                self.scene_dots.draw()
+                self.bee.draw()
+                self.timer.flip(POST_DOT, number+1)
+                if number == 0 and frameN == 0:
+                    self.responses.mark_onset() # latency between key press and first post-decisional frame
+
+
+    def outcome(self):
+        # response, rt, key time and accuracy (relative to the average evidence that was shown), -99 when timed-out
+        if self.key is None:
+            return 'timed-out', -99, -99, -99
+        accuracy = int(task_logic.score_accuracy(self.pre_evidence.mean, self.key.name == self.choice_keys[1]))
+        return self.key.name, self.key.rt, self.key.tDown, accuracy
+
+
+    def record(self, writer, dot_store, trial, running, difficulty_level, threshold_estimate, cj, RTconf):
+        # data of the trial (trial: row of the schedule), the trial is handed to the writer by writer.nextEntry()
+        response, rt, key_time, accuracy = self.outcome()
+        writer.addData("block", self.block)
+        writer.addData("trial", self.trial_number)
+        writer.addData("running", running) #practice or main
+        writer.addData("difficulty", self.difficulty) #absolute distance from the center
+        writer.addData("difficulty_level", difficulty_level) # level in dif_lvl (with adaptive difficulty: index in target_accuracy)
+        writer.addData("threshold_estimate", threshold_estimate) # difficulty with ~81% accuracy (posterior mean), -99 without adaptive difficulty
+        writer.addData("distance", self.mean[0]) #signed distance from the center
+        writer.addData("target", task_logic.target_side[int(trial['target_right'])])
+        writer.addData("response", response)
+        writer.addData("accuracy", accuracy)
+        writer.addData("rt", rt)
+        writer.addData("key_time", key_time) # time stamp of the key press (keyboard driver)
+        writer.addData("response_onset_latency", self.responses.onset_latency) # key press until first post-decisional frame
+        writer.addData("cj", cj)
+        writer.addData("RTconf", RTconf)
+        writer.addData("dots_index", dot_store.add_trial(self.location_dots, self.location_add_dots, # coordinates and durations of each dot (pre and post) are in the dot store
+                                                         self.timer.dot_durations(PRE_DOT), self.timer.dot_durations(POST_DOT)))
+        writer.addData("pre_dots_location_mean", self.pre_evidence.mean) # mean x coordinates all dots
+        writer.addData("post_dots_location_mean", self.post_evidence.mean if self.key is not None else -99)
+        writer.addData("pre_dots_location_var", self.pre_evidence.variance) # variance x coordinates
+        writer.addData("post_dots_location_var", self.post_evidence.variance)
+        writer.addData("pre_llr", self.pre_evidence.llr) # log-likelihood ratio right vs. left of the dots before the response
+        writer.addData("post_llr", self.post_evidence.llr) # idem for the post-decisional dots
+        writer.addData("shift_post_dots", task_logic.post_evi[0 if trial['stronger'] else 1])
+        writer.addData("shift", int(trial['shift']))
+        for timing_column, timing_value in self.timer.summary().items(): # frame timing of this trial (max frame interval, dropped frames per phase, mean/max dot duration)
+            writer.addData(timing_column, timing_value)
@@ -0,0 +1,181 @@
+"""
+Crash-safe trial writer for the Beehives Paradigm
+
+- Drop-in replacement for data.ExperimentHandler (addData/nextEntry), but every completed trial is
+  appended to the csv file straight away instead of when Python is closed.
+- Writing happens in a background thread: nextEntry() only puts the trial on a queue,
+  so a slow disk never delays the flip loop.
+- The file is line-buffered and fsync'ed every fsync_every trials, so a crash or power cut loses at most a few trials.
+- call() runs a function in the writer thread after all trials handed over before it are flushed to the OS (e.g. checkpoints),
+  so a crash of the script never leaves the function ahead of the data. Nothing is fsync'ed for it, only every fsync_every trials.
+- append=True continues an existing file (resumed session).
+- An error in the writer thread (e.g. disk full, failing checkpoint) does not stop it: the remaining trials are still
+  written and the error is raised in the main thread by the next nextEntry(), flush() or close().
+- Other stores (e.g. the binary dot store, the checkpoint) can be passed as sync_also (flush() and sync()),
+  they are flushed and fsync'ed together with the csv file, after it.
+- Same layout as ExperimentHandler.saveAsWideText: data columns in the order they were first added,
+  followed by the extraInfo columns (sub, age, ...).
+"""
+
+import atexit
+import csv
+import os
+import queue
+import threading
+
+
+class TrialWriter:
+
+    def __init__(self, dataFileName, extraInfo=None, fsync_every=10, sync_also=(), append=False):
+        self.file_name      = dataFileName + '.csv'
+        self.extraInfo      = dict(extraInfo) if extraInfo else {}
+        self.fsync_every    = fsync_every
+        self.sync_also      = list(sync_also)
+
+        self.columns        = None # fixed after the first trial
+        self.extra_columns  = []   # columns that were first added after the header was written
+        self.entry          = {}
+        self.n_entries      = 0
+        self.error          = None # first error in the writer thread, not raised yet
+
+        mode                = 'a' if append and os.path.isfile(self.file_name) else 'w'
+        if mode == 'a': # header is already in the file
+            with open(self.file_name, newline='') as f:
+                reader          = csv.reader(f)
+                header          = next(reader, None)
+                self.n_entries  = sum(1 for row in reader)
+            if header:
+                self.columns = [name for name in header if name not in self.extraInfo]
+
+        self.file           = open(self.file_name, mode, newline='', buffering=1)
+        self.csv            = csv.writer(self.file)
+        self.queue          = queue.Queue()
+        self.thread         = threading.Thread(target=self._run, name='TrialWriter', daemon=True)
+        self.thread.start()
+        self.closed         = False
+        atexit.register(self.close) # also write the remaining trials when core.quit() is called
+
+
+    def addData(self, name, value):
+        self.entry[name] = value
+
+
+    def nextEntry(self):
+        # hand the trial to the writer thread and start a new (empty) entry
+        entry           = self.entry
+        self.entry      = {}
+        self.n_entries += 1
+        self.queue.put(entry)
+        self._check()
+        return entry
+
+
+    def call(self, function, *args):
+        # function(*args) is run in the writer thread once the trials before it are on disk
+        self.queue.put((function, args))
+
+
+    def flush(self):
+        # wait until all trials handed over so far are on disk (do not call in between stimulus frames)
+        self.queue.put('flush')
+        self.queue.join()
+        self._check()
+
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.entry: # ExperimentHandler also saves the last entry if nextEntry() was not called
+            self.nextEntry()
+        self.queue.put(None)
+        self.thread.join()
+        self.file.close()
+        if self.extra_columns:
+            self._rewrite_header()
+        self._check()
+
+
+    def _check(self):
+        # raise the error of the writer thread in the main thread (once)
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+
+    def _run(self):
+        written = 0
+        while True:
+            entry = self.queue.get()
+            try:
+                if entry is None:
+                    self._sync()
+                    return
+                if entry == 'flush':
+                    self._sync()
+                    continue
+                if isinstance(entry, tuple):
+                    self._flush()
+                    function, args = entry
+                    function(*args)
+                    continue
+                self._write(entry)
+                written += 1
+                if written % self.fsync_every == 0:
+                    self._sync()
+            except Exception as error: # the thread keeps going, later trials are still written
+                if self.error is None:
+                    self.error = error
+                if entry is None:
+                    return
+            finally:
+                self.queue.task_done()
+
+
+    def _write(self, entry):
+        if self.columns is None:
+            self.columns = list(entry)
+            self.csv.writerow(self.columns + list(self.extraInfo))
+
+        for name in entry:
+            if name not in self.columns and name not in self.extra_columns:
+                self.extra_columns.append(name)
+
+        row = [entry.get(name, '') for name in self.columns] + list(self.extraInfo.values())
+        if self.extra_columns: # kept at the end of the line, header is fixed when the file is closed
+            row += [entry.get(name, '') for name in self.extra_columns]
+        self.csv.writerow(row)
+
+
+    def _flush(self):
+        # written data to the OS (survives a crash of the script, not a power cut)
+        self.file.flush()
+        for store in self.sync_also:
+            store.flush()
+
+
+    def _sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        for store in self.sync_also:
+            store.sync()
+
+
+    def _rewrite_header(self):
+        # columns that appeared after the first trial: move them in front of extraInfo as ExperimentHandler would
+        with open(self.file_name, newline='') as f:
+            rows = list(csv.reader(f))
+        n_data  = len(self.columns)
+        n_extra = len(self.extraInfo)
+        header  = self.columns + self.extra_columns + list(self.extraInfo)
+        body    = []
+        for row in rows[1:]:
+            row     = row + [''] * (n_data + n_extra + len(self.extra_columns) - len(row))
+            body.append(row[:n_data] + row[n_data + n_extra:] + row[n_data:n_data + n_extra])
+
+        temp_name = self.file_name + '.tmp'
+        with open(temp_name, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            writer.writerows(body)
+        os.replace(temp_name, self.file_name)